@@ -1,19 +1,33 @@
 # coding: utf-8
 
 import sys
-from PyQt5.QtCore import pyqtSignal, QSettings, QThread, QTimer
-from PyQt5.QtWidgets import QApplication, QFileDialog, QMainWindow, QMessageBox, QTabBar, QWidget
+from PyQt5.QtCore import pyqtSignal, QDate, QObject, QSettings, Qt, QThread, QTime, QTimer
+from PyQt5.QtWidgets import (QApplication, QCheckBox, QComboBox, QDateEdit, QFileDialog, QFormLayout, QGroupBox, QHBoxLayout, QLabel,
+                             QLineEdit, QMainWindow, QMessageBox, QProgressBar, QSpinBox, QTabBar, QTimeEdit, QWidget)
 from swing_mainWindow import Ui_MainWindow
 import sheet_swing_calculation as ssc
+import history_batch
+from analysis_cache import AnalysisCache
+import history_loader
+import record_archive
+from binary_record import BINARY_SUFFIX
+from sample_parser import SampleParser
+from sample_store import SampleStore, to_epoch_us
+from stream_recorder import RecordWriter, save_record
 
+import numpy as np
 import logging
 from logging.handlers import TimedRotatingFileHandler
+import multiprocessing
 import traceback
 import os
 import re
+import shutil
+import threading
 import serial
 import serial.tools.list_ports
 from datetime import datetime, timedelta
+from time import monotonic
 
 
 def setupLogger():
@@ -43,6 +57,19 @@ def setupLogger():
 # Call the logger
 logger = logging.getLogger(__name__)
 
+# (name, max sheets, max age in microseconds) of the live statistics window
+LIVE_WINDOWS = [('Last 100 sheets', 100, None), ('Last 1000 sheets', 1000, None),
+                ('Last hour', None, 3600*10**6), ('Since start', None, None)]
+
+COM_STATUS_COLOR = {'connected': 'green', 'wrong format': 'orange',
+                    'searching...': 'blue', 'disconnected': 'red'}
+# worst first, the status label of several ports takes the color of the worst one
+COM_STATUS_ORDER = ('disconnected', 'wrong format', 'searching...', 'connected')
+
+def channel_suffix(channel):
+    # file name suffix of a sensor channel, the first sensor keeps the plain daily name
+    return f'_ch{channel}' if channel else ''
+
 class TabBar(QTabBar):
     def sizeHint(self):
         hint = super().sizeHint()
@@ -71,41 +98,172 @@ class TabBar(QTabBar):
 
 
 class SerialThread(QThread):
-    signal_ser_raw = pyqtSignal(str, datetime)
-    signal_ser_empty = pyqtSignal()
-    signal_ser_status = pyqtSignal()
-    def __init__(self,myWin,parent=None):
+    signal_ser_sample = pyqtSignal(int, datetime, int)
+    signal_ser_block = pyqtSignal(int, object, object)
+    signal_ser_wrong = pyqtSignal(int, str)
+    signal_ser_empty = pyqtSignal(int)
+    signal_ser_status = pyqtSignal(int)
+    def __init__(self,ser,channel=0,batch_interval=0,parent=None):
         super(SerialThread,self).__init__(parent)
-        self.myWin=myWin
+        self.ser=ser
+        self.channel=channel
+        self.batch_interval=batch_interval
+        self.parser=SampleParser()
         self.active=False
 
     def run(self):
         logger.info('Start moniroting thread')
         #parameter setting
         self.active=True
+        if self.batch_interval > 0:
+            self.run_batch()
+        else:
+            while self.active:
+                # read data from serial port
+                try:
+                    raw_data=self.ser.readline()
+                    raw_time = datetime.now()
+                except Exception:
+                    logger.error(f'{traceback.format_exc()}')
+                    self.active=False
+                    continue
+                if not len(raw_data.strip()):
+                    self.signal_ser_empty.emit(self.channel)
+                    continue
+                data = self.parser.parse_line(raw_data)
+                if data is None:
+                    self.signal_ser_wrong.emit(self.channel, raw_data.strip().decode(errors='replace'))
+                else:
+                    self.signal_ser_sample.emit(self.channel, raw_time, data)
+        logger.info(f'Stop moniroting thread of {self.ser.port}: {self.parser.good} samples, {self.parser.malformed} malformed lines')
+        self.signal_ser_status.emit(self.channel)
+
+    def run_batch(self):
+        # read whatever is waiting, parse it here and emit (time_us, distance) blocks
+        block_time = []
+        block_dis = []
+        emit_at = monotonic()+self.batch_interval/1000
+        # wake up at least once per interval, the port counts as empty after its own timeout
+        empty_timeout = self.ser.timeout
+        self.ser.timeout = self.batch_interval/1000
+        last_data = monotonic()
         while self.active:
-            # read data from serial port
             try:
-                raw_data=self.myWin.ser.readline().decode().strip()
+                chunk = self.ser.read(max(self.ser.in_waiting, 1))
                 raw_time = datetime.now()
-                if not len(raw_data):
-                    self.signal_ser_empty.emit()
-                else:
-                    self.signal_ser_raw.emit(raw_data, raw_time)
-            except UnicodeDecodeError:
-                logger.error(f'{traceback.format_exc()}')
             except Exception:
                 logger.error(f'{traceback.format_exc()}')
                 self.active=False
                 continue
-            # print(raw_time)
-            # print(raw_data)
-        logger.info('Stop moniroting thread')
-        self.signal_ser_status.emit()
+            if chunk:
+                last_data = monotonic()
+            elif monotonic()-last_data >= empty_timeout:
+                self.signal_ser_empty.emit(self.channel)
+                last_data = monotonic()
+            time_us, data, wrong = self.parser.feed(chunk, to_epoch_us(raw_time))
+            for raw in wrong:
+                self.signal_ser_wrong.emit(self.channel, raw)
+            if data.size:
+                block_time.append(time_us)
+                block_dis.append(data)
+            if block_time and monotonic() >= emit_at:
+                self.signal_ser_block.emit(self.channel, np.concatenate(block_time), np.concatenate(block_dis))
+                block_time = []
+                block_dis = []
+                emit_at = monotonic()+self.batch_interval/1000
+        if block_time:
+            self.signal_ser_block.emit(self.channel, np.concatenate(block_time), np.concatenate(block_dis))
         
     def exit(self):
         self.active=False
 
+class AcquisitionManager(QObject):
+    signal_stopped = pyqtSignal()
+    def __init__(self,ports,baudrate,batch_interval=0,parent=None):
+        super(AcquisitionManager,self).__init__(parent)
+        self.ports=ports
+        self.baudrate=baudrate
+        self.batch_interval=batch_interval
+        self.sers={}
+        self.threads={}
+
+    def open(self):
+        # open every port or none of them
+        try:
+            for channel, port in enumerate(self.ports):
+                self.sers[channel]=serial.Serial(port,self.baudrate,timeout=2)
+        except serial.SerialException:
+            for ser in self.sers.values():
+                ser.close()
+            self.sers={}
+            raise
+        self.start_time=monotonic()
+        for channel, ser in self.sers.items():
+            self.threads[channel]=SerialThread(ser, channel=channel, batch_interval=self.batch_interval)
+            self.threads[channel].signal_ser_status.connect(self.channel_stopped)
+
+    def start(self):
+        for thread in self.threads.values():
+            thread.start()
+
+    def exit(self):
+        for thread in self.threads.values():
+            thread.exit()
+
+    def channel_stopped(self, channel):
+        # close the port of a finished worker, report when all of them are done
+        self.sers.pop(channel).close()
+        if not self.sers:
+            self.signal_stopped.emit()
+
+    def stats(self):
+        elapsed = max(monotonic()-self.start_time, 1e-6)
+        return {self.ports[channel]: {'samples': thread.parser.good,
+                                      'malformed': thread.parser.malformed,
+                                      'rate': thread.parser.good/elapsed}
+                for channel, thread in self.threads.items()}
+
+class AnalysisThread(QThread):
+    signal_progress = pyqtSignal(int, int)
+    signal_result = pyqtSignal(object)
+    signal_error = pyqtSignal(str)
+    def __init__(self,fileNames,dis_from,dis_to,cycle_min,cycle_max,window=None,timestamps=False,cache=None,pool=None,parent=None):
+        super(AnalysisThread,self).__init__(parent)
+        self.fileNames=fileNames
+        self.args=(dis_from,dis_to,cycle_min,cycle_max)
+        self.window=window
+        self.timestamps=timestamps
+        self.cache=cache
+        self.pool=pool
+        self.cancel=threading.Event()
+
+    def run(self):
+        logger.info(f'Start analysis of {len(self.fileNames)} file(s)')
+        try:
+            sheet_count, swing_overlap, summary = history_batch.analyze_files(self.fileNames, *self.args,
+                                                                              progress=self.signal_progress.emit,
+                                                                              cancel=self.cancel,
+                                                                              window=self.window,
+                                                                              timestamps=self.timestamps,
+                                                                              cache=self.cache,
+                                                                              pool=self.pool)
+            swing_result = ssc.get_swing_range(swing_overlap, sheet_count)
+        except ssc.SwingException:
+            self.signal_error.emit('Swing is not in the distance range or the sample is not enough.\nPlease check your input or raw data.')
+            return
+        except history_batch.AnalysisCancelled:
+            logger.info('Analysis cancelled')
+            self.signal_error.emit('')
+            return
+        except Exception:
+            logger.error(f'{traceback.format_exc()}')
+            self.signal_error.emit('Analysis failed, see the log for details.')
+            return
+        self.signal_result.emit((sheet_count, swing_overlap, summary, swing_result))
+
+    def exit(self):
+        self.cancel.set()
+
 class MyMainWindow(QMainWindow, Ui_MainWindow):
     def __init__(self, parent=None):
         super(MyMainWindow, self).__init__(parent)
@@ -127,6 +285,73 @@ class MyMainWindow(QMainWindow, Ui_MainWindow):
         self.tabWidget.addTab(self.tab1, "Real-Time Record")
         self.tabWidget.addTab(self.tab2, "History Data Analysis")
         self.tabWidget.setStyleSheet('QTabBar { font-size: 14pt; font-family: Gill Sans; }')
+        # set up recording mode
+        self.checkBox_record = QCheckBox('Write to disk while monitoring', self.groupBox_2)
+        self.verticalLayout_6.addWidget(self.checkBox_record)
+        self.checkBox_binary = QCheckBox('Binary record files (.swb)', self.groupBox_2)
+        self.verticalLayout_6.addWidget(self.checkBox_binary)
+        self.checkBox_archive = QCheckBox('Compress days before yesterday', self.groupBox_2)
+        self.verticalLayout_6.addWidget(self.checkBox_archive)
+        # set up extra sensors, recorded as channel 1, 2, ...
+        self.lineEdit_extraport = QLineEdit(self.groupBox)
+        self.lineEdit_extraport.setPlaceholderText('e.g. COM4, COM5')
+        self.formLayout.addRow(QLabel('Extra ports:', self.groupBox), self.lineEdit_extraport)
+        # set up date range of daily files in the folder of the loaded file
+        self.checkBox_daterange = QCheckBox('Daily files from', self.groupBox_4)
+        self.dateEdit_from = QDateEdit(QDate.currentDate(), self.groupBox_4)
+        self.dateEdit_to = QDateEdit(QDate.currentDate(), self.groupBox_4)
+        self.horizontalLayout_daterange = QHBoxLayout()
+        self.horizontalLayout_daterange.addWidget(self.checkBox_daterange)
+        self.horizontalLayout_daterange.addWidget(self.dateEdit_from)
+        self.horizontalLayout_daterange.addWidget(QLabel('to', self.groupBox_4))
+        self.horizontalLayout_daterange.addWidget(self.dateEdit_to)
+        # channel 0 is the main port, channel N the extra port recorded as %y%m%d_chN
+        self.spinBox_channel = QSpinBox(self.groupBox_4)
+        self.spinBox_channel.setRange(0, 99)
+        self.horizontalLayout_daterange.addWidget(QLabel('channel', self.groupBox_4))
+        self.horizontalLayout_daterange.addWidget(self.spinBox_channel)
+        self.verticalLayout_7.addLayout(self.horizontalLayout_daterange)
+        # set up time of day window, only that part of each file is read and analyzed
+        self.checkBox_timewindow = QCheckBox('Time of day from', self.groupBox_4)
+        self.timeEdit_from = QTimeEdit(self.groupBox_4)
+        self.timeEdit_to = QTimeEdit(self.groupBox_4)
+        self.timeEdit_from.setDisplayFormat('HH:mm')
+        self.timeEdit_to.setDisplayFormat('HH:mm')
+        self.horizontalLayout_timewindow = QHBoxLayout()
+        self.horizontalLayout_timewindow.addWidget(self.checkBox_timewindow)
+        self.horizontalLayout_timewindow.addWidget(self.timeEdit_from)
+        self.horizontalLayout_timewindow.addWidget(QLabel('to', self.groupBox_4))
+        self.horizontalLayout_timewindow.addWidget(self.timeEdit_to)
+        self.verticalLayout_7.addLayout(self.horizontalLayout_timewindow)
+        # set up segmentation on the recorded times, robust to lost samples and any sample rate
+        self.checkBox_timestamps = QCheckBox('Segment sheets by the recorded time', self.groupBox_4)
+        self.verticalLayout_7.addWidget(self.checkBox_timestamps)
+        # set up the disk tier of the analysis cache, the sheets found in a file are kept next to it
+        self.checkBox_diskcache = QCheckBox('Keep analyzed sheets on disk', self.groupBox_4)
+        self.verticalLayout_7.addWidget(self.checkBox_diskcache)
+        # set up live sheet detection on the real-time tab
+        self.groupBox_live = QGroupBox('Live sheets', self.tab)
+        self.formLayout_live = QFormLayout(self.groupBox_live)
+        self.comboBox_livewindow = QComboBox(self.groupBox_live)
+        self.comboBox_livewindow.addItems([window[0] for window in LIVE_WINDOWS])
+        self.lineEdit_livecount = self.live_field()
+        self.lineEdit_livelast = self.live_field()
+        self.lineEdit_liverate = self.live_field()
+        self.lineEdit_liveavg = self.live_field()
+        self.lineEdit_livefirst = self.live_field()
+        self.lineEdit_livelastavg = self.live_field()
+        self.formLayout_live.addRow('Window:', self.comboBox_livewindow)
+        self.formLayout_live.addRow('Sheet count (pcs):', self.lineEdit_livecount)
+        self.formLayout_live.addRow('Last swing (mm):', self.lineEdit_livelast)
+        self.formLayout_live.addRow('Sheets per minute:', self.lineEdit_liverate)
+        self.formLayout_live.addRow('Average swing (mm):', self.lineEdit_liveavg)
+        self.formLayout_live.addRow('First 20% swing (mm):', self.lineEdit_livefirst)
+        self.formLayout_live.addRow('Last 20% swing (mm):', self.lineEdit_livelastavg)
+        self.verticalLayout.addWidget(self.groupBox_live)
+        # set up analysis progress
+        self.progressBar_run = QProgressBar(self.groupBox_5)
+        self.progressBar_run.setVisible(False)
+        self.verticalLayout_10.addWidget(self.progressBar_run)
         # get COM ports list
         port_list = serial.tools.list_ports.comports()
         com_list = []
@@ -160,19 +385,61 @@ class MyMainWindow(QMainWindow, Ui_MainWindow):
         self.doubleSpinBox_cyclesmall.setValue(self.cycle_condition['small']['length'])
         self.checkBox_cyclebig.setChecked(self.cycle_condition['big']['check'])
         self.doubleSpinBox_cyclebig.setValue(self.cycle_condition['big']['length'])
+        self.checkBox_record.setChecked(self.settings.value('record to disk', False, type=bool))
+        self.checkBox_binary.setChecked(self.settings.value('record binary', False, type=bool))
+        self.checkBox_archive.setChecked(self.settings.value('archive days', False, type=bool))
+        self.lineEdit_extraport.setText(self.settings.value('extra COM ports', '', type=str))
+        self.checkBox_daterange.setChecked(self.settings.value('date range', False, type=bool))
+        self.spinBox_channel.setValue(self.settings.value('date range channel', 0, type=int))
+        self.checkBox_timewindow.setChecked(self.settings.value('time window', False, type=bool))
+        self.timeEdit_from.setTime(QTime.fromString(self.settings.value('time window from', '08:00', type=str), 'HH:mm'))
+        self.timeEdit_to.setTime(QTime.fromString(self.settings.value('time window to', '16:00', type=str), 'HH:mm'))
+        self.checkBox_timestamps.setChecked(self.settings.value('segment by time', False, type=bool))
+        self.checkBox_diskcache.setChecked(self.settings.value('analysis disk cache', False, type=bool))
+        self.comboBox_livewindow.setCurrentIndex(self.settings.value('live window', 0, type=int))
+        self.plot_trend.mpl.set_window(capacity=self.settings.value('trend samples', 1000, type=int),
+                                       span=self.settings.value('trend span', 60, type=float))
+        if self.plot_trend.comboBox_span.findData(self.settings.value('trend span', 60, type=int)) >= 0:
+            self.plot_trend.comboBox_span.setCurrentIndex(self.plot_trend.comboBox_span.findData(self.settings.value('trend span', 60, type=int)))
         # variables
-        self.swing_data = ''
+        self.sample_stores = {0: SampleStore()}
+        self.recorders = {}
+        self.sheet_detectors = {}
+        self.live_sheets = {}
+        self.analysis_cache = AnalysisCache(disk=self.checkBox_diskcache.isChecked())
+        self.analysis_pool = history_batch.AnalysisPool()
+        self.timer_stats = QTimer()
+        self.timer_stats.timeout.connect(self.show_stats)
+        self.COM_status = {}
         # connect signal
         self.push_renew.clicked.connect(self.renew_port)
         self.comboBox_port.currentTextChanged.connect(lambda: self.settings.setValue('COM port', self.comboBox_port.currentText()))
         self.comboBox_baud.currentTextChanged.connect(lambda: self.settings.setValue('baudrate', self.comboBox_baud.currentText()))
         self.push_saveroute.clicked.connect(self.saveroute_choose)
+        self.checkBox_record.stateChanged.connect(lambda: self.settings.setValue('record to disk', self.checkBox_record.isChecked()))
+        self.checkBox_binary.stateChanged.connect(lambda: self.settings.setValue('record binary', self.checkBox_binary.isChecked()))
+        self.checkBox_archive.stateChanged.connect(lambda: self.settings.setValue('archive days', self.checkBox_archive.isChecked()))
+        self.lineEdit_extraport.textChanged.connect(lambda: self.settings.setValue('extra COM ports', self.lineEdit_extraport.text()))
+        self.spinBox_notefrom.valueChanged.connect(self.note_change)
+        self.spinBox_noteto.valueChanged.connect(self.note_change)
+        self.spinBox_notefrom.valueChanged.connect(self.live_reset)
+        self.spinBox_noteto.valueChanged.connect(self.live_reset)
+        self.comboBox_livewindow.currentIndexChanged.connect(lambda: self.settings.setValue('live window', self.comboBox_livewindow.currentIndex()))
+        self.plot_trend.comboBox_span.currentIndexChanged.connect(lambda: self.settings.setValue('trend span', self.plot_trend.comboBox_span.currentData()))
+        self.comboBox_livewindow.currentIndexChanged.connect(self.live_reset)
         self.textEdit_saveroute.textChanged.connect(lambda: self.settings.setValue('save route', self.textEdit_saveroute.toPlainText()))
         self.push_start.clicked.connect(self.monitor_state)
         self.push_clear.clicked.connect(self.clear_data)
         self.push_save.clicked.connect(self.save_data)
         self.push_loadfile.clicked.connect(self.load_file)
         self.textEdit_loadfile.textChanged.connect(lambda: self.settings.setValue('load file', self.textEdit_loadfile.toPlainText()))
+        self.checkBox_daterange.stateChanged.connect(lambda: self.settings.setValue('date range', self.checkBox_daterange.isChecked()))
+        self.spinBox_channel.valueChanged.connect(lambda: self.settings.setValue('date range channel', self.spinBox_channel.value()))
+        self.checkBox_timewindow.stateChanged.connect(lambda: self.settings.setValue('time window', self.checkBox_timewindow.isChecked()))
+        self.timeEdit_from.timeChanged.connect(lambda: self.settings.setValue('time window from', self.timeEdit_from.time().toString('HH:mm')))
+        self.timeEdit_to.timeChanged.connect(lambda: self.settings.setValue('time window to', self.timeEdit_to.time().toString('HH:mm')))
+        self.checkBox_timestamps.stateChanged.connect(lambda: self.settings.setValue('segment by time', self.checkBox_timestamps.isChecked()))
+        self.checkBox_diskcache.stateChanged.connect(self.diskcache_change)
         self.spinBox_disfrom.valueChanged.connect(lambda: self.settings.setValue('distance from', self.spinBox_disfrom.value()))
         self.spinBox_disto.valueChanged.connect(lambda: self.settings.setValue('distance to', self.spinBox_disto.value()))
         self.checkBox_cyclesmall.stateChanged.connect(lambda: self.cycle_condition_change('small', 'check'))
@@ -180,6 +447,12 @@ class MyMainWindow(QMainWindow, Ui_MainWindow):
         self.checkBox_cyclebig.stateChanged.connect(lambda: self.cycle_condition_change('big', 'check'))
         self.doubleSpinBox_cyclebig.valueChanged.connect(lambda: self.cycle_condition_change('big', 'length'))
         self.push_run.clicked.connect(self.swing_calculation)
+
+    def live_field(self):
+        lineEdit = QLineEdit(self.groupBox_live)
+        lineEdit.setAlignment(Qt.AlignRight|Qt.AlignTrailing|Qt.AlignVCenter)
+        lineEdit.setReadOnly(True)
+        return lineEdit
         
     def renew_port(self):
         # clear old list and add new list
@@ -206,27 +479,46 @@ class MyMainWindow(QMainWindow, Ui_MainWindow):
     def monitor_state(self):
         if self.push_start.isChecked():
             self.push_start.setText("Monitoring...")
-            self.lineEdit_COM.setText("searching...")
-            self.lineEdit_COM.setStyleSheet("color: blue; font-size: 10pt; font-family: Calibri;")
             # create serial, thread and timer instance
+            ports = [self.comboBox_port.currentText()]+[port.strip() for port in self.lineEdit_extraport.text().split(',') if port.strip()]
+            self.reset_COM_status(ports, 'searching...')
+            self.acquisition = AcquisitionManager(ports, self.comboBox_baud.currentText(),
+                                                  batch_interval=self.settings.value('serial batch interval', 0, type=int))
             try:
-                self.ser=serial.Serial(self.comboBox_port.currentText(),self.comboBox_baud.currentText(),timeout=2)
+                self.acquisition.open()
             except serial.SerialException:
                 logger.error(f'{traceback.format_exc()}')
                 QMessageBox.critical(self, 'Error', 
                                      'The access to the COM port is denied.\nPlease choose a right COM port.')
                 self.push_start.setChecked(False)
                 self.push_start.setText("Start")
-                self.lineEdit_COM.setText("disconnected")
-                self.lineEdit_COM.setStyleSheet("color: red; font-size: 10pt; font-family: Calibri;")
+                self.reset_COM_status(ports, 'disconnected')
                 return
-            self.ser_thread = SerialThread(myWin=self)
-            # connect signal from thread to main window
-            self.ser_thread.signal_ser_raw.connect(self.data_process)
-            self.ser_thread.signal_ser_empty.connect(self.COM_empty)
-            self.ser_thread.signal_ser_status.connect(self.exit_thread)
-            # start the thread and plot
-            self.ser_thread.start()
+            # write samples straight to the daily files in recording mode
+            if self.checkBox_record.isChecked():
+                for channel in self.acquisition.threads:
+                    self.recorders[channel] = RecordWriter(self.textEdit_saveroute.toPlainText(), self.note_text(),
+                                                           flush_interval=self.settings.value('record flush interval', 1.0, type=float),
+                                                           flush_size=self.settings.value('record flush size', 600, type=int),
+                                                           fsync=self.settings.value('record fsync', False, type=bool),
+                                                           suffix=channel_suffix(channel),
+                                                           binary=self.checkBox_binary.isChecked())
+                    self.recorders[channel].start()
+            self.checkBox_record.setEnabled(False)
+            self.checkBox_binary.setEnabled(False)
+            self.lineEdit_extraport.setEnabled(False)
+            # connect signal from threads to main window
+            for channel, thread in self.acquisition.threads.items():
+                self.sample_stores.setdefault(channel, SampleStore())
+                thread.signal_ser_sample.connect(self.data_process)
+                thread.signal_ser_wrong.connect(self.COM_wrong)
+                thread.signal_ser_block.connect(self.block_process)
+                thread.signal_ser_empty.connect(self.COM_empty)
+                thread.signal_ser_status.connect(self.COM_stopped)
+            self.acquisition.signal_stopped.connect(self.exit_thread)
+            # start the threads and plot
+            self.acquisition.start()
+            self.timer_stats.start(1000)
             self.plot_trend.mpl.toggle_pause()
             # calculate the delta time and start the single shot timer
             time1 = datetime.now()
@@ -240,57 +532,156 @@ class MyMainWindow(QMainWindow, Ui_MainWindow):
             self.timer_midnight.timeout.connect(self.save_midnight)
             self.timer_midnight.start(round(delta.total_seconds()*1000))
         else:
-            self.ser_thread.exit()
+            self.acquisition.exit()
             
-    def data_process(self, raw, time):
-        result_raw = re.match('\$,\d+$', raw)
-        if result_raw:
-            self.lineEdit_COM.setText("connected")
-            self.lineEdit_COM.setStyleSheet("color: green; font-size: 10pt; font-family: Calibri;")
-            data = int(raw.split(',')[1])
-        else:
-            self.lineEdit_COM.setText("wrong format")
-            self.lineEdit_COM.setStyleSheet("color: orange; font-size: 10pt; font-family: Calibri;")
-            logger.warning(f'Data format from serial port is wrong. Raw string: {raw}')
+    def set_COM_status(self, channel, status):
+        # status of one port, returns whether it changed
+        if self.COM_status.get(channel) == status:
+            return False
+        self.COM_status[channel] = status
+        self.show_COM_status()
+        return True
+
+    def reset_COM_status(self, ports, status):
+        self.COM_status = dict.fromkeys(range(len(ports)), status)
+        self.show_COM_status()
+
+    def show_COM_status(self):
+        # the status of every port in channel order, restyled only when it changes
+        text = ' / '.join(self.COM_status[channel] for channel in sorted(self.COM_status))
+        if text == self.lineEdit_COM.text():
             return
-        self.swing_data = self.swing_data+re.sub('\$', time.strftime('%Y-%m-%d %H:%M:%S.%f'), raw)+'\n'
-        self.plot_trend.mpl.update_line_data(time, data)
+        worst = min(self.COM_status.values(), key=COM_STATUS_ORDER.index)
+        self.lineEdit_COM.setText(text)
+        self.lineEdit_COM.setStyleSheet(f"color: {COM_STATUS_COLOR[worst]}; font-size: 10pt; font-family: Calibri;")
+
+    def data_process(self, channel, time, data):
+        self.set_COM_status(channel, 'connected')
+        if self.recorders:
+            self.recorders[channel].put(time, data)
+        else:
+            self.sample_stores[channel].append(time, data)
+        self.plot_trend.mpl.update_line_data(time, data, channel)
+        if self.live_detector(channel):
+            sheet = self.sheet_detectors[channel].update(data, to_epoch_us(time))
+            if sheet is not None:
+                self.live_sheet([sheet], channel)
+
+    def block_process(self, channel, time_us, data):
+        self.set_COM_status(channel, 'connected')
+        if self.recorders:
+            self.recorders[channel].put_block(time_us, data)
+        else:
+            self.sample_stores[channel].extend(time_us, data)
+        self.plot_trend.mpl.update_line_block(time_us, data, channel)
+        if self.live_detector(channel):
+            sheets = self.sheet_detectors[channel].update_block(data.tolist(), time_us)
+            if sheets:
+                self.live_sheet(sheets, channel)
+
+    def live_detector(self, channel):
+        # sheets are detected inside the distance range of glass, with the cycle limits of the analysis
+        if channel not in self.sheet_detectors:
+            if self.spinBox_noteto.value() <= self.spinBox_notefrom.value():
+                return None
+            self.sheet_detectors[channel] = ssc.SheetDetector(self.spinBox_notefrom.value(), self.spinBox_noteto.value(),
+                                                              *self.cycle_limits())
+            name, max_count, max_age = LIVE_WINDOWS[self.comboBox_livewindow.currentIndex()]
+            self.live_sheets[channel] = {'last': 'NA', 'stats': ssc.RollingSwingStats(max_count, max_age)}
+        return self.sheet_detectors[channel]
+
+    def live_sheet(self, sheets, channel):
+        live = self.live_sheets[channel]
+        live['last'] = sheets[-1]['swing']
+        for sheet in sheets:
+            live['stats'].add(sheet['swing'], sheet['time'])
+        self.live_show()
+
+    def live_show(self):
+        # one value per channel, separated by '/'
+        channels = sorted(self.live_sheets)
+        stats = [self.live_sheets[c]['stats'].stats() for c in channels]
+        def join(values):
+            return ' / '.join(value if value == 'NA' else "%.2f" % value for value in values)
+        self.lineEdit_livecount.setText(' / '.join(str(self.sheet_detectors[c].count) for c in channels))
+        self.lineEdit_livelast.setText(join(self.live_sheets[c]['last'] for c in channels))
+        self.lineEdit_liverate.setText(' / '.join(str(stat[4]) for stat in stats))
+        self.lineEdit_liveavg.setText(join(stat[1] for stat in stats))
+        self.lineEdit_livefirst.setText(join(stat[2] for stat in stats))
+        self.lineEdit_livelastavg.setText(join(stat[3] for stat in stats))
+
+    def live_reset(self):
+        self.sheet_detectors = {}
+        self.live_sheets = {}
+        for lineEdit in (self.lineEdit_livecount, self.lineEdit_livelast, self.lineEdit_liverate,
+                         self.lineEdit_liveavg, self.lineEdit_livefirst, self.lineEdit_livelastavg):
+            lineEdit.clear()
         
-    def COM_empty(self):
+    def COM_empty(self, channel):
+        # logged once until the port sends again
+        if self.push_start.isChecked() and self.set_COM_status(channel, 'searching...'):
+            logger.warning(f'{self.acquisition.ports[channel]} is empty.')
+
+    def COM_wrong(self, channel, raw):
+        self.set_COM_status(channel, 'wrong format')
+        logger.warning(f'Data format from {self.acquisition.ports[channel]} is wrong. Raw string: {raw}')
+
+    def COM_stopped(self, channel):
+        # a worker that ends while monitoring has lost its port, the other ports go on
         if self.push_start.isChecked():
-            self.lineEdit_COM.setText("searching...")
-            self.lineEdit_COM.setStyleSheet("color: blue; font-size: 10pt; font-family: Calibri;")
-            logger.warning(f'{self.comboBox_port.currentText()} is empty.')
+            logger.warning(f'{self.acquisition.ports[channel]} stopped while monitoring.')
+        self.set_COM_status(channel, 'disconnected')
+
+    def show_stats(self):
+        # time based live windows also shrink while no sheet arrives
+        if self.live_sheets:
+            for live in self.live_sheets.values():
+                live['stats'].expire(to_epoch_us(datetime.now()))
+            self.live_show()
+        stats = self.acquisition.stats()
+        self.statusbar.showMessage(' | '.join(f"{port}: {self.COM_status.get(channel, '')}, {stats[port]['rate']:.1f}/s, "
+                                              f"{stats[port]['malformed']} wrong"
+                                              for channel, port in enumerate(self.acquisition.ports) if port in stats))
             
     def exit_thread(self):
         # end monitoring
         self.push_start.setChecked(False)
         self.push_start.setText("Start")
-        self.lineEdit_COM.setText("disconnected")
-        self.lineEdit_COM.setStyleSheet("color: red; font-size: 10pt; font-family: Calibri;")
-        # stop the serial and timer
+        self.reset_COM_status(self.acquisition.ports, 'disconnected')
+        # stop the recorders and timers, the ports are closed by their workers
         self.timer_midnight.stop()
+        self.timer_stats.stop()
+        self.show_stats()
         self.plot_trend.mpl.toggle_pause()
-        self.ser.close()
-        # delete the serial, thread and timer instance
-        del self.ser_thread
-        del self.ser
+        for recorder in self.recorders.values():
+            recorder.stop()
+        self.recorders = {}
+        self.checkBox_record.setEnabled(True)
+        self.checkBox_binary.setEnabled(True)
+        self.lineEdit_extraport.setEnabled(True)
+        # delete the acquisition and timer instance
+        del self.acquisition
         del self.timer_midnight
         
             
     def save_midnight(self):
-        # save daily data
+        # save daily data, the recorder rotates its file by itself
         # fileTime = datetime.now()-timedelta(minutes=1)
         # fileName = os.path.join(self.textEdit_saveroute.toPlainText(),fileTime.strftime('%y%m%d_%H%M00')+'.txt')
         # split_time = datetime.now().strftime('%Y-%m-%d %H:%M')
-        fileTime = datetime.now()-timedelta(days=1)
-        fileName = os.path.join(self.textEdit_saveroute.toPlainText(),fileTime.strftime('%y%m%d')+'.txt')
-        split_time = datetime.now().strftime('%Y-%m-%d')
-        swing_split = re.split(split_time, self.swing_data, 1)
-        self.swing_data = split_time+swing_split[1]
-        with open(fileName,'w') as f:
-            print(f'Distance range: {self.spinBox_notefrom.value()} ~ {self.spinBox_noteto.value()}', file=f)
-            f.write(swing_split[0])
+        if not self.recorders:
+            fileTime = datetime.now()-timedelta(days=1)
+            split_time = datetime.combine(datetime.now().date(), datetime.min.time())
+            for channel, store in self.sample_stores.items():
+                fileName = os.path.join(self.textEdit_saveroute.toPlainText(),fileTime.strftime('%y%m%d')+channel_suffix(channel)+'.txt')
+                split_count = store.split_index(split_time)
+                threading.Thread(target=save_record,
+                                 args=(fileName, self.note_text(), store.take_front(split_count))).start()
+        # compress completed days, yesterday's file may still be written for a while
+        if self.checkBox_archive.isChecked():
+            threading.Thread(target=record_archive.archive_days,
+                             args=(self.textEdit_saveroute.toPlainText(), datetime.now().date()-timedelta(days=1)),
+                             daemon=True).start()
         # set the next timer
         time1 = datetime.now()
         # time2 = time1+timedelta(minutes=1)
@@ -304,31 +695,57 @@ class MyMainWindow(QMainWindow, Ui_MainWindow):
         self.timer_midnight.start(round(delta.total_seconds()*1000))
         
     def clear_data(self):
-        self.swing_data = ''
+        for store in self.sample_stores.values():
+            store.clear()
+        self.live_reset()
         self.plot_trend.mpl.plot_clear()
         
     def save_data(self):
         fileTime = datetime.now().strftime('%y%m%d_%H%M%S')
-        fileName = os.path.join(self.textEdit_saveroute.toPlainText(),fileTime+'.txt')
+        fileName = os.path.join(self.textEdit_saveroute.toPlainText(),fileTime+(BINARY_SUFFIX if self.checkBox_binary.isChecked() else '.txt'))
         name = QFileDialog.getSaveFileName(self, 'Save File',
                                            fileName,
-                                           "Text files (*.txt)")
+                                           "Text files (*.txt);;Binary record files (*.swb)")
         if name[0]:
-            with open(name[0],'w') as f:
-                print(f'Distance range: {self.spinBox_notefrom.value()} ~ {self.spinBox_noteto.value()}', file=f)
-                f.write(self.swing_data)
+            root, ext = os.path.splitext(name[0])
+            if self.recorders:
+                # copy today's record files, in the format they are recorded in
+                for channel, recorder in self.recorders.items():
+                    recorder.flush()
+                    try:
+                        source = recorder.file_name(datetime.now())
+                        shutil.copyfile(source, root+channel_suffix(channel)+os.path.splitext(source)[1])
+                    except OSError:
+                        logger.error(f'{traceback.format_exc()}')
+                        QMessageBox.critical(self, 'Error',
+                                             'Can not copy the record file.')
+                return
+            # written off the GUI thread like save_midnight, the views stay valid as appends never overwrite them
+            for channel, store in self.sample_stores.items():
+                threading.Thread(target=save_record,
+                                 args=(root+channel_suffix(channel)+ext, self.note_text(), list(store.chunks()),
+                                       ext == BINARY_SUFFIX)).start()
+
+    def note_text(self):
+        return f'{self.spinBox_notefrom.value()} ~ {self.spinBox_noteto.value()}'
+
+    def note_change(self):
+        for recorder in self.recorders.values():
+            recorder.note = self.note_text()
     
     def load_file(self):
-        name = QFileDialog.getOpenFileName(self, 'Load History Data',
-                                           self.textEdit_loadfile.toPlainText(),
-                                           "Text files (*.txt)")
+        name = QFileDialog.getOpenFileNames(self, 'Load History Data',
+                                            self.textEdit_loadfile.toPlainText().split('\n')[0],
+                                            "Record files (*.txt *.swb *.txt.gz *.swb.gz)")
         if name[0]:
-            self.textEdit_loadfile.setText(name[0])
-            with open(name[0]) as f:
-                dis_range = re.match('Distance range: (\d+) ~ (\d+)', f.readline())
-                if dis_range:
-                    self.spinBox_disfrom.setValue(int(dis_range.group(1)))
-                    self.spinBox_disto.setValue(int(dis_range.group(2)))
+            self.textEdit_loadfile.setText('\n'.join(name[0]))
+            try:
+                dis_range = re.match('(\d+) ~ (\d+)', history_loader.read_note(name[0][0]) or '')
+            except (OSError, ValueError):
+                dis_range = None
+            if dis_range:
+                self.spinBox_disfrom.setValue(int(dis_range.group(1)))
+                self.spinBox_disto.setValue(int(dis_range.group(2)))
         
     def cycle_condition_change(self, key_1, key_2):
         if key_2 == 'check':
@@ -336,42 +753,81 @@ class MyMainWindow(QMainWindow, Ui_MainWindow):
         elif key_2 == 'length':
             self.cycle_condition[key_1][key_2] = self.sender().value()
         self.settings.setValue('cycle', self.cycle_condition)
-        
-    def swing_calculation(self):
-        # read file data
-        self.hist_time = []
-        self.hist_swing = []
-        try:
-            with open(self.textEdit_loadfile.toPlainText()) as f:
-                f.readline()
-                for line in f:
-                    data = line.split(',')
-                    # self.hist_time.append(data[0])
-                    self.hist_swing.append(int(data[1]))
-        except FileNotFoundError:
-            QMessageBox.critical(self, 'Error', 
-                                 'Can not find the file.')
-            self.push_run.setChecked(False)
-            return
-        # calculation
+        self.live_reset()
+
+    def cycle_limits(self):
+        # in seconds
         if self.cycle_condition['small']['check']:
-            cycle_min = self.cycle_condition['small']['length']*10
+            cycle_min = self.cycle_condition['small']['length']
         else:
             cycle_min = 0
         if self.cycle_condition['big']['check']:
-            cycle_max = self.cycle_condition['big']['length']*10
+            cycle_max = self.cycle_condition['big']['length']
         else:
-            cycle_max = 36000   # 1 hour
+            cycle_max = 3600   # 1 hour
+        return cycle_min, cycle_max
+        
+    def history_files(self):
+        # loaded files, or the daily files of the chosen dates in their folder
+        fileNames = [name for name in self.textEdit_loadfile.toPlainText().split('\n') if name]
+        if not self.checkBox_daterange.isChecked():
+            return fileNames
+        folder = fileNames[0] if fileNames and os.path.isdir(fileNames[0]) else os.path.dirname(fileNames[0] if fileNames else '')
         try:
-            sheet_count, swing_overlap = ssc.get_each_sheet(self.hist_swing, 
-                                                            self.spinBox_disfrom.value(), self.spinBox_disto.value(), 
-                                                            cycle_min, cycle_max)
-        except ssc.SwingException:
+            return history_batch.daily_files(folder or '.', self.dateEdit_from.date().toPyDate(), self.dateEdit_to.date().toPyDate(),
+                                             channel_suffix(self.spinBox_channel.value()))
+        except OSError:
+            return []
+
+    def swing_calculation(self):
+        # a second click cancels the running analysis
+        if not self.push_run.isChecked():
+            self.analysis_thread.exit()
+            self.push_run.setEnabled(False)
+            return
+        # check file data
+        fileNames = self.history_files()
+        if not fileNames or not all(os.path.isfile(name) for name in fileNames):
             QMessageBox.critical(self, 'Error', 
-                                 'Swing is not in the distance range or the sample is not enough.\nPlease check your input or raw data.')
+                                 'Can not find the file.')
             self.push_run.setChecked(False)
             return
-        swing_range, avg_all, avg_first20, avg_last20, ind_first20, ind_last20 = ssc.get_swing_range(swing_overlap, sheet_count)
+        # calculation
+        cycle_min, cycle_max = self.cycle_limits()
+        if self.checkBox_timewindow.isChecked():
+            window = (self.timeEdit_from.time().toPyTime(), self.timeEdit_to.time().toPyTime())
+        else:
+            window = None
+        self.analysis_thread = AnalysisThread(fileNames,
+                                              self.spinBox_disfrom.value(), self.spinBox_disto.value(),
+                                              cycle_min, cycle_max, window,
+                                              self.checkBox_timestamps.isChecked(), self.analysis_cache,
+                                              self.analysis_pool)
+        self.analysis_thread.signal_progress.connect(self.analysis_progress)
+        self.analysis_thread.signal_result.connect(self.analysis_result)
+        self.analysis_thread.signal_error.connect(self.analysis_error)
+        self.analysis_thread.finished.connect(self.analysis_finished)
+        self.push_run.setText("Running... (click to cancel)")
+        self.progressBar_run.setRange(0, 0 if len(fileNames) == 1 else len(fileNames))
+        self.progressBar_run.setValue(0)
+        self.progressBar_run.setVisible(True)
+        self.analysis_thread.start()
+
+    def diskcache_change(self):
+        self.analysis_cache.disk = self.checkBox_diskcache.isChecked()
+        self.settings.setValue('analysis disk cache', self.checkBox_diskcache.isChecked())
+
+    def analysis_progress(self, done, total):
+        self.progressBar_run.setValue(done)
+
+    def analysis_result(self, result):
+        sheet_count, swing_overlap, summary, swing_result = result
+        for item in summary:
+            if 'error' in item:
+                logger.warning(f"Skip {item['file']}: {item['error']}")
+            else:
+                logger.info(f"{item['file']}: {item['count']} sheets, average swing {item['avg_all']:.2f}")
+        swing_range, avg_all, avg_first20, avg_last20, ind_first20, ind_last20 = swing_result
         # show the answer
         self.lineEdit_count.setText(str(sheet_count))
         self.lineEdit_avgall.setText("%.2f" % avg_all)
@@ -384,17 +840,35 @@ class MyMainWindow(QMainWindow, Ui_MainWindow):
         # plot histogram
         self.plot_hist.mpl.plot_hist(swing_range)
         self.plot_hist.mpl.plot_swing(swing_overlap, ind_first20, ind_last20)
+
+    def analysis_error(self, message):
+        if message:
+            QMessageBox.critical(self, 'Error', message)
+
+    def analysis_finished(self):
         # reset run button
         self.push_run.setChecked(False)
+        self.push_run.setEnabled(True)
+        self.push_run.setText("Run")
+        self.progressBar_run.setVisible(False)
+        del self.analysis_thread
         
     def closeEvent(self, event):
         reply = QMessageBox.information(self, 'Warning', 'Are you sure to quit?',
                                      QMessageBox.Yes, QMessageBox.No)
         if reply==QMessageBox.Yes:
             event.accept()
+            if self.push_run.isChecked():
+                self.push_run.setChecked(False)
+                self.swing_calculation()
+                self.analysis_thread.wait()
+            self.analysis_pool.stop()
             if self.push_start.isChecked():
                 self.push_start.setChecked(False)
                 self.monitor_state()
+                for recorder in self.recorders.values():
+                    recorder.stop()
+                self.recorders = {}
             # clear handlers of logger and shutdown logger
             logger.debug('End of application: Swing Detection')
             logger.handlers.clear()
@@ -404,6 +878,8 @@ class MyMainWindow(QMainWindow, Ui_MainWindow):
         
 
 if __name__=="__main__":  
+    # the analysis workers of a frozen Windows executable start through here
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)  
     myWin = MyMainWindow()
     myWin.show()  
@@ -3,14 +3,22 @@ import matplotlib
 
 matplotlib.use("Qt5Agg")
 # from PyQt5.QtWidgets import QApplication, QVBoxLayout, QSizePolicy, QWidget
-from PyQt5.QtWidgets import QVBoxLayout, QSizePolicy, QWidget
+from PyQt5.QtWidgets import QComboBox, QHBoxLayout, QVBoxLayout, QSizePolicy, QWidget
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
 from matplotlib.figure import Figure
 
 import matplotlib.animation as animation
 import matplotlib.dates as mdates
-from datetime import timedelta
+import numpy as np
+from datetime import datetime
+from sample_store import to_epoch_us
+from trend_buffer import MinMaxPyramid, RingBuffer
+
+# (label, seconds) of the spans the live plot can be zoomed out to
+TREND_SPANS = [('1 min', 60), ('10 min', 600), ('1 hour', 3600), ('8 hours', 8*3600)]
+# (bucket width in seconds, buckets kept) of every min/max level, finest first
+TREND_LEVELS = [(1, 8*3600), (10, 8*360), (60, 24*60)]
 
 class MyMplCanvas(FigureCanvas):
     """FigureCanvas的最終的父類其實是QWidget。"""
@@ -32,45 +40,100 @@ class MyMplCanvas(FigureCanvas):
                                    QSizePolicy.Expanding)
         # FigureCanvas.updateGeometry(self)
         
-        # Store x and y
-        self.x = []
-        self.y = []
+        # Store x (matplotlib date numbers) and y of every channel in fixed size ring buffers
+        self.capacity = 1000
+        self.span = 1/1440     # 1 minute
+        self.step = self.span/6
+        self.x_offset = mdates.date2num(datetime(1970, 1, 1))
+        self.buffers = {}
+        self.pyramids = {}
+        self.lines = {}
         
         # Store a figure and ax
-        self.line, = self.ax.plot(self.x, self.y)
+        self.add_channel(0)
         self.ax.grid(True)
         self.fig.suptitle('Distance change over time', fontsize=12)
         self.ax.set_xlabel('Time')
         self.ax.set_ylabel('Distance (mm)')
         self.ax.tick_params(axis='x', labelrotation = 30)
         self.ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M:%S'))
+        self.xmax = None
         
         # Call superclass constructors
         self.anim = animation.FuncAnimation(self.fig, self.animate, init_func=self.plot_init, 
-                                            interval=200, blit=False)
+                                            interval=200, blit=True, cache_frame_data=False)
         self.paused = True
 
     def plot_init(self):
         self.ax.set_ylim(ymin=200, ymax=700)
-        return self.line,
+        return tuple(self.lines.values())
 
     def animate(self, i):
         if i==0:
             self.anim.pause()
-            return self.line,
-        self.line.set_xdata(self.x)
-        self.line.set_ydata(self.y)
-        try:
-            self.ax.set_xlim(xmin=self.x[-1]-timedelta(minutes=1),xmax=self.x[-1])
-        except IndexError:
-            pass
-        return self.line,
+            return tuple(self.lines.values())
+        x_last = max((buffer.last() for buffer in self.buffers.values() if len(buffer)), default=None)
+        if x_last is None:
+            return tuple(self.lines.values())
+        # Scroll the axis by whole steps, only then the ticks and the blit background are redrawn
+        xmax = np.ceil(x_last/self.step)*self.step
+        if xmax != self.xmax:
+            self.xmax = xmax
+            self.ax.set_xlim(xmin=xmax-self.span, xmax=xmax)
+            self.draw()
+        width = max(int(self.ax.bbox.width), 1)
+        for channel, line in self.lines.items():
+            line.set_data(*self.visible(channel, width))
+        return tuple(self.lines.values())
+
+    def visible(self, channel, width):
+        # the raw samples while they cover the span in a few points per pixel, else the finest min/max level that does
+        xmin = self.xmax-self.span
+        buffer = self.buffers[channel]
+        x, y = buffer.view()
+        start = np.searchsorted(x, xmin)
+        if (len(buffer) < buffer.capacity or start > 0) and x.size-start <= 4*width:
+            return decimate(x[start:], y[start:], width)
+        pyramid = self.pyramids[channel]
+        for level_width, level in zip(pyramid.widths, pyramid.levels):
+            x, y = level.view()
+            start = np.searchsorted(x, xmin-level_width)
+            if (len(level) < level.capacity or start > 0) and x.size-start <= 2*width or level is pyramid.levels[-1]:
+                break
+        return np.repeat(x[start:], 2), y[start:].ravel()
+
+    def set_window(self, capacity=None, span=None):
+        # samples kept per channel and time span shown (seconds), whichever is shorter limits the plot
+        if capacity is not None and capacity != self.capacity:
+            self.capacity = capacity
+            for buffer in self.buffers.values():
+                buffer.resize(capacity)
+        if span is not None:
+            self.span = span/86400
+            self.step = self.span/6
+            self.xmax = None
+
+    def add_channel(self, channel):
+        self.buffers[channel] = RingBuffer(self.capacity)
+        self.pyramids[channel] = MinMaxPyramid([(width/86400, count) for width, count in TREND_LEVELS])
+        self.lines[channel], = self.ax.plot([], [], animated=True)
+
+    def append(self, channel, x, y):
+        if channel not in self.lines:
+            self.add_channel(channel)
+        self.buffers[channel].extend(x, y)
+        self.pyramids[channel].extend(x, y)
         
-    def update_line_data(self, x, y):
-        self.x.append(x)
-        self.x = self.x[-1000:]
-        self.y.append(y)
-        self.y = self.y[-1000:]
+    def update_line_data(self, x, y, channel=0):
+        # one sample, without the array round trip of a block
+        if channel not in self.lines:
+            self.add_channel(channel)
+        x = to_epoch_us(x)/86400e6+self.x_offset
+        self.buffers[channel].append(x, y)
+        self.pyramids[channel].push(x, y)
+    
+    def update_line_block(self, x_us, y, channel=0):
+        self.append(channel, x_us/86400e6+self.x_offset, y)
     
     def toggle_pause(self, *args, **kwargs):
         if self.paused:
@@ -80,13 +143,23 @@ class MyMplCanvas(FigureCanvas):
         self.paused = not self.paused
         
     def plot_clear(self):
-        self.x = []
-        self.y = []
-        self.line.set_xdata(self.x)
-        self.line.set_ydata(self.y)
+        for channel, line in self.lines.items():
+            self.buffers[channel].clear()
+            self.pyramids[channel].clear()
+            line.set_data([], [])
         self.draw()
 
 
+def decimate(x, y, width):
+    # keep the min and max of every pixel column when there are more points than pixels
+    if x.size <= 2*width:
+        return x, y
+    starts = np.linspace(0, x.size, width, endpoint=False).astype(int)
+    x_out = np.repeat(x[starts], 2)
+    y_out = np.column_stack([np.minimum.reduceat(y, starts), np.maximum.reduceat(y, starts)]).ravel()
+    return x_out, y_out
+
+
 class MatplotlibWidget_anim(QWidget):
     def __init__(self, parent=None):
         super(MatplotlibWidget_anim, self).__init__(parent)
@@ -95,10 +168,18 @@ class MatplotlibWidget_anim(QWidget):
     def initUi(self):
         self.mpl = MyMplCanvas(self)
         self.mpl_ntb = NavigationToolbar(self.mpl, self)  # 增加完整的 toolbar
+        self.comboBox_span = QComboBox(self)
+        for label, seconds in TREND_SPANS:
+            self.comboBox_span.addItem(label, seconds)
+        self.comboBox_span.currentIndexChanged.connect(
+            lambda: self.mpl.set_window(span=self.comboBox_span.currentData()))
         
         self.layout = QVBoxLayout(self)
         self.layout.addWidget(self.mpl)
-        self.layout.addWidget(self.mpl_ntb) #排列toolbar
+        self.layout_bar = QHBoxLayout()
+        self.layout_bar.addWidget(self.mpl_ntb) #排列toolbar
+        self.layout_bar.addWidget(self.comboBox_span)
+        self.layout.addLayout(self.layout_bar)
 
 
 # if __name__ == '__main__':
@@ -7,9 +7,14 @@ from PyQt5.QtWidgets import QVBoxLayout, QSizePolicy, QWidget
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
 from matplotlib import cycler, rcParams
+from matplotlib.collections import LineCollection
 from matplotlib.figure import Figure
 
 import numpy as np
+from sheet_swing_calculation import SheetSet
+
+# Above this many sheets the overlap is drawn as a density map instead of lines
+DENSITY_LIMIT = 500
 
 
 class MyMplCanvas(FigureCanvas):
@@ -34,10 +39,10 @@ class MyMplCanvas(FigureCanvas):
         self.ax_1.set_xlabel('Swing range (mm)')
         self.ax_1.set_ylabel('Count')
         self.ax_2.set_title('Swing overlap of the first 20% sheets', fontsize=12)
-        self.ax_2.set_xlabel('Time (0.1 s)')
+        self.ax_2.set_xlabel('Time (s)')
         self.ax_2.set_ylabel('Distance (mm)')
         self.ax_3.set_title('Swing overlap of the last 20% sheets', fontsize=12)
-        self.ax_3.set_xlabel('Time (0.1 s)')
+        self.ax_3.set_xlabel('Time (s)')
         self.ax_3.set_ylabel('Distance (mm)')
 
         FigureCanvas.__init__(self, self.fig)
@@ -55,7 +60,8 @@ class MyMplCanvas(FigureCanvas):
     def plot_hist(self, x):
         self.ax_1.cla()
         start=2.5*(x.min()//2.5)
-        self.ax_1.hist(x, bins=np.arange(start, x.max() + 2.5, 2.5))
+        counts, edges = np.histogram(x, bins=np.arange(start, x.max() + 2.5, 2.5))
+        self.ax_1.stairs(counts, edges, fill=True)
         self.ax_1.set_title('Swing range distribution', fontsize=12)
         self.ax_1.set_xlabel('Swing range (mm)')
         self.ax_1.set_ylabel('Count')
@@ -63,24 +69,54 @@ class MyMplCanvas(FigureCanvas):
         self.draw()
         
     def plot_swing(self, overlap, ind_first20, ind_last20):
+        sheets_first20 = select_sheets(overlap, ind_first20)
+        sheets_last20 = select_sheets(overlap, ind_last20)
+        # seconds at the rate of the sheets, samples when the files had different rates
+        xlabel = 'Time (s)' if sheets_first20.rate else 'Samples'
         self.ax_2.cla()
-        self.ax_2.plot(overlap[:, ind_first20], lw = 1)
+        self.plot_overlap(self.ax_2, sheets_first20)
         self.ax_2.set_xlim(xmin=0)
         self.ax_2.set_title('Swing overlap of the first 20% sheets', fontsize=12)
-        self.ax_2.set_xlabel('Time (0.1 s)')
+        self.ax_2.set_xlabel(xlabel)
         self.ax_2.set_ylabel('Distance (mm)')
         self.ax_2.grid(True)
         
         self.ax_3.cla()
-        self.ax_3.plot(overlap[:, ind_last20], lw = 1)
+        self.plot_overlap(self.ax_3, sheets_last20)
         self.ax_3.set_xlim(self.ax_2.get_xlim())
         self.ax_3.set_ylim(self.ax_2.get_ylim())
         self.ax_3.set_title('Swing overlap of the last 20% sheets', fontsize=12)
-        self.ax_3.set_xlabel('Time (0.1 s)')
+        self.ax_3.set_xlabel(xlabel)
         self.ax_3.set_ylabel('Distance (mm)')
         self.ax_3.grid(True)
         self.draw()
 
+    def plot_overlap(self, ax, sheets):
+        # One collection for all the sheets, or a 2D histogram of them when there are too many to tell apart
+        if len(sheets) == 0:
+            return
+        step = 1/sheets.rate if sheets.rate else 1
+        if len(sheets) <= DENSITY_LIMIT:
+            points = np.column_stack([sheets.positions()*step, sheets.values])
+            colors = rcParams['axes.prop_cycle'].by_key()['color']
+            ax.add_collection(LineCollection(np.split(points, sheets.offsets[1:-1]), lw=1,
+                                             colors=[colors[i % len(colors)] for i in range(len(sheets))]))
+            ax.autoscale_view()
+        else:
+            x_edges = (np.arange(sheets.cycles.max()+1)-0.5)*step
+            y_edges = np.linspace(sheets.values.min(), sheets.values.max()+1, 101)
+            counts = np.histogram2d(sheets.positions()*step, sheets.values, bins=(x_edges, y_edges))[0]
+            ax.pcolormesh(x_edges, y_edges, np.ma.masked_equal(counts.T, 0), cmap='Blues')
+
+
+def select_sheets(overlap, index):
+    # Sheets at `index` of a SheetSet or of the columns of a NaN padded matrix
+    if isinstance(overlap, SheetSet):
+        return overlap.select(index)
+    columns = np.atleast_2d(overlap[:, index].T)
+    valid = ~np.isnan(columns)
+    return SheetSet(columns[valid], np.insert(valid.sum(axis=1).cumsum(), 0, 0))
+
 
 class MatplotlibWidget_hist(QWidget):
     def __init__(self, parent=None):
@@ -0,0 +1,150 @@
+import glob
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import sheet_swing_calculation as ssc
+from history_loader import cache_name
+from record_archive import ARCHIVE_SUFFIX
+
+
+def file_identity(fileName):
+    # a rewritten or growing file is a new file, taken before the file is read
+    stat = os.stat(fileName)
+    return os.path.abspath(fileName), stat.st_size, stat.st_mtime_ns
+
+
+def runs_name(identity, params):
+    return cache_name(identity[0], runs_tag(params), '.npz', identity[1:])
+
+
+def runs_tag(params):
+    return 'runs-'+hashlib.sha1(repr(params).encode()).hexdigest()[:12]
+
+
+def prune_runs(folder, max_bytes):
+    # drop the least recently used runs sidecars of a cache folder until they fit in `max_bytes`
+    entries = []
+    for name in glob.glob(os.path.join(glob.escape(folder), '*.runs-*.npz')):
+        try:
+            stat = os.stat(name)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(name)
+        except OSError:
+            continue
+        total -= size
+
+
+def save_runs(identity, params, runs, max_bytes=None):
+    # .npz sidecar of the runs of a file for one set of parameters, next to the loader caches,
+    # the folder then pruned to `max_bytes` of runs sidecars
+    tag = runs_tag(params)
+    cacheName = runs_name(identity, params)
+    try:
+        os.makedirs(os.path.dirname(cacheName), exist_ok=True)
+        for stale in glob.glob(glob.escape(cacheName.split(f'.{tag}.')[0])+f'.{tag}.*.npz'):
+            os.remove(stale)
+        with open(cacheName+'.part', 'wb') as f:
+            np.savez(f, values=runs.sheets.values, offsets=runs.sheets.offsets, cycles=runs.cycles,
+                     inner=runs.inner, rate=runs.rate)
+        os.replace(cacheName+'.part', cacheName)
+        if max_bytes is not None:
+            prune_runs(os.path.dirname(cacheName), max_bytes)
+    except OSError:
+        pass
+
+
+def load_runs(identity, params):
+    try:
+        cacheName = runs_name(identity, params)
+        with np.load(cacheName) as data:
+            # the mtime of a sidecar is its last use, for prune_runs
+            os.utime(cacheName)
+            rate = float(data['rate'])
+            return ssc.SheetRuns(ssc.SheetSet(data['values'], data['offsets'], rate=rate), data['cycles'],
+                                 data['inner'], rate)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+class AnalysisCache:
+    """Analysis results by file identity and parameters, least recently used ones dropped first."""
+
+    def __init__(self, max_bytes=256 << 20, disk=False, disk_bytes=1 << 30):
+        # Two stages per file: the runs in the distance range, keyed by the file and the parameters
+        # before the cycle filter, and the sheets after the cycle filter. Other cycle limits only
+        # filter the cached runs again. With `disk` the runs are also saved next to the file, at
+        # most `disk_bytes` of them per cache folder, least recently used ones removed first, and
+        # not for compressed archives, which get no uncompressed sidecars
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self.disk_bytes = disk_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, value, nbytes):
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+            self.entries[key] = (value, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                self.size -= self.entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def on_disk(self, identity):
+        return self.disk and not identity[0].endswith(ARCHIVE_SUFFIX)
+
+    def sheets(self, identity, params, cycle_limits):
+        # (count, sheets) of a file (file_identity) from the cache, filtered from its cached runs when
+        # only the cycle limits changed, None when the runs have to be found. params: everything before
+        # the cycle filter
+        result = self.get(('sheets', identity, params, cycle_limits))
+        if result is not None:
+            return result
+        runs = self.get(('runs', identity, params))
+        if runs is None and self.on_disk(identity):
+            runs = load_runs(identity, params)
+            if runs is not None:
+                self.put(('runs', identity, params), runs, runs.nbytes)
+        if runs is None:
+            return None
+        return self.filter(identity, params, cycle_limits, runs)
+
+    def add_runs(self, identity, params, cycle_limits, runs):
+        # keep the runs found for a file, with the identity it had before it was read, return its (count, sheets)
+        self.put(('runs', identity, params), runs, runs.nbytes)
+        if self.on_disk(identity):
+            save_runs(identity, params, runs, self.disk_bytes)
+        return self.filter(identity, params, cycle_limits, runs)
+
+    def filter(self, identity, params, cycle_limits, runs):
+        count, sheets = runs.filter_cycles(*cycle_limits, ragged=True, dtype='float32')
+        sheets.values.flags.writeable = False
+        self.put(('sheets', identity, params, cycle_limits), (count, sheets), sheets.values.nbytes+sheets.offsets.nbytes)
+        return count, sheets
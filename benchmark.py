@@ -0,0 +1,173 @@
+"""Time the analysis and acquisition hot paths on synthetic data and keep the results as JSON.
+
+python benchmark.py --sizes hour day week --output bench/this.json --compare bench/last.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import history_loader
+import sheet_swing_calculation as ssc
+from sample_parser import SampleParser
+from sample_store import SampleStore, format_lines, to_epoch_us
+from signal_generator import SAMPLE_RATE, generate_swing, write_record
+from trend_buffer import MinMaxPyramid, RingBuffer
+
+SIZES = {'hour': 3600*SAMPLE_RATE, 'day': 86400*SAMPLE_RATE,
+         'week': 7*86400*SAMPLE_RATE, 'month': 30*86400*SAMPLE_RATE}
+# samples pushed one by one through the acquisition path, whatever the size
+STREAM_SAMPLES = 20000
+# the bucket widths (days) and lengths of the live plot pyramid
+TREND_LEVELS = [(1/86400, 8*3600), (10/86400, 8*360), (60/86400, 24*60)]
+
+
+def measure(function, repeat):
+    # best wall time of `repeat` runs, then the peak of traced memory in one more run
+    best = float('inf')
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter()-start)
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def stream_samples(swing):
+    # the per sample path of the GUI without Qt: parse, store, plot buffers and live detector
+    parser = SampleParser()
+    store = SampleStore()
+    ring = RingBuffer(1000)
+    pyramid = MinMaxPyramid(TREND_LEVELS)
+    detector = ssc.SheetDetector(300, 700, 2, 3600)
+    lines = [b'$,%d\r\n' % d for d in swing]
+    now = datetime.now()
+    x = 19000.0
+    for line in lines:
+        data = parser.parse_line(line)
+        store.append(now, data)
+        ring.extend(np.array([x]), np.array([data]))
+        pyramid.extend(np.array([x]), np.array([data]))
+        detector.update(data, to_epoch_us(now))
+        x += 1/864000
+
+
+def stream_blocks(swing):
+    # the batch path: one second of samples per block
+    parser = SampleParser()
+    store = SampleStore()
+    ring = RingBuffer(1000)
+    pyramid = MinMaxPyramid(TREND_LEVELS)
+    detector = ssc.SheetDetector(300, 700, 2, 3600)
+    time_us = to_epoch_us(datetime.now())
+    for start in range(0, swing.size, SAMPLE_RATE):
+        data = b''.join(b'$,%d\r\n' % d for d in swing[start:start+SAMPLE_RATE])
+        times, dist, wrong = parser.feed(data, time_us)
+        store.extend(times, dist)
+        x = times/86400e6
+        ring.extend(x, dist)
+        pyramid.extend(x, dist)
+        detector.update_block(dist.tolist(), times)
+        time_us += 10**6
+
+
+def run_size(name, samples, folder, repeat):
+    swing = generate_swing(samples, seed=samples)
+    fileName = os.path.join(folder, f'{name}.txt')
+    write_record(fileName, swing, to_epoch_us(datetime(2023, 3, 1)), '300 ~ 700')
+    times_us = to_epoch_us(datetime(2023, 3, 1))+np.arange(min(samples, 1 << 20))*(10**6//SAMPLE_RATE)
+    count, sheets = ssc.get_each_sheet(swing, 300, 700, 20, 36000, ragged=True, dtype='float32')
+    history_loader.load_swing(fileName)   # build the cache sidecars
+    file_times = history_loader.load_times(fileName)
+    runs = ssc.find_sheets(swing, 300, 700)
+    stages = {
+        'format_lines': lambda: format_lines(times_us, swing[:times_us.size]),
+        'load_text': lambda: history_loader.parse_swing(fileName),
+        'load_cached': lambda: np.asarray(history_loader.load_swing(fileName)).sum(),
+        'get_each_sheet': lambda: ssc.get_each_sheet(swing, 300, 700, 20, 36000),
+        'get_each_sheet_ragged': lambda: ssc.get_each_sheet(swing, 300, 700, 20, 36000, ragged=True, dtype='float32'),
+        'get_each_sheet_timed': lambda: ssc.get_each_sheet(swing, 300, 700, 20, 36000, ragged=True, dtype='float32',
+                                                           times=file_times),
+        'filter_cycles': lambda: runs.filter_cycles(2, 3600, ragged=True, dtype='float32'),
+        'get_swing_range': lambda: ssc.get_swing_range(sheets, count),
+    }
+    results = {}
+    for stage, function in stages.items():
+        seconds, peak = measure(function, repeat if samples <= SIZES['day'] else 1)
+        results[stage] = {'seconds': seconds, 'peak_bytes': peak}
+        print(f'{name:>6} {stage:<22} {seconds*1000:10.1f} ms {peak/2**20:10.1f} MiB', flush=True)
+    return {'samples': samples, 'sheets': count, 'file_bytes': os.path.getsize(fileName), 'stages': results}
+
+
+def run_stream(repeat):
+    swing = generate_swing(STREAM_SAMPLES)
+    results = {}
+    for stage, function in (('per_sample', stream_samples), ('per_block', stream_blocks)):
+        seconds, peak = measure(lambda: function(swing), repeat)
+        results[stage] = {'seconds': seconds, 'us_per_sample': seconds/STREAM_SAMPLES*1e6, 'peak_bytes': peak}
+        print(f'stream {stage:<22} {seconds/STREAM_SAMPLES*1e6:10.2f} us/sample {peak/2**20:6.1f} MiB', flush=True)
+    return {'samples': STREAM_SAMPLES, 'stages': results}
+
+
+def version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+def compare(results, fileName):
+    # ratio of every stage time to the same stage in an older result file
+    with open(fileName) as f:
+        old = json.load(f)
+    print(f"\ncompared with {old.get('version') or fileName} (new/old time)")
+    for size, result in results['sizes'].items():
+        for stage, value in result['stages'].items():
+            try:
+                before = old['sizes'][size]['stages'][stage]['seconds']
+            except KeyError:
+                continue
+            print(f"{size:>6} {stage:<22} {value['seconds']/before:6.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the swing analysis and acquisition paths.')
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['hour', 'day', 'week'],
+                        help='amounts of data at 10 Hz, default hour day week')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage, the best is kept (sizes up to a day)')
+    parser.add_argument('--output', help='result file, default benchmark_<version>_<time>.json')
+    parser.add_argument('--compare', help='an older result file to compare with')
+    args = parser.parse_args(argv)
+
+    results = {'version': version(), 'time': datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.platform(),
+               'sizes': {}}
+    with tempfile.TemporaryDirectory() as folder:
+        for name in args.sizes:
+            results['sizes'][name] = run_size(name, SIZES[name], folder, args.repeat)
+    results['sizes']['stream'] = run_stream(args.repeat)
+    output = args.output or f"benchmark_{results['version'] or 'unknown'}_{datetime.now():%Y%m%d%H%M%S}.json"
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'results saved to {output}')
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
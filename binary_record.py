@@ -0,0 +1,118 @@
+import argparse
+import os
+import struct
+import sys
+import numpy as np
+from sample_store import format_lines
+
+BINARY_SUFFIX = '.swb'
+MAGIC = b'SWINGBIN'
+VERSION = 2
+# magic, version, note length (bytes), then the UTF-8 note padded to 16 bytes. Version 1 had
+# a sample rate (float32) after the note length, it was never measured and is skipped
+HEADER = struct.Struct('<8sHH')
+RATE_V1 = struct.Struct('<f')
+RECORD_DTYPE = np.dtype([('time', '<i8'), ('dist', '<i2')])
+
+
+class PartialHeader(ValueError):
+    pass
+
+
+def header_bytes(note):
+    note = note.encode('utf-8')[:0xffff]
+    size = -(-(HEADER.size+len(note))//16)*16
+    return (HEADER.pack(MAGIC, VERSION, len(note))+note).ljust(size, b'\0')
+
+
+def read_header(f):
+    # (note, offset of the first record) of an open binary record file, PartialHeader when the
+    # file ends inside the header
+    data = f.read(HEADER.size)
+    if data[:len(MAGIC)] != MAGIC[:len(data)]:
+        raise ValueError(f'{f.name} is not a binary record file')
+    if len(data) < HEADER.size:
+        raise PartialHeader(f'{f.name} ends inside its header')
+    magic, version, length = HEADER.unpack(data)
+    if version > VERSION:
+        raise ValueError(f'{f.name} has the unknown record version {version}')
+    size = HEADER.size+length+(RATE_V1.size if version == 1 else 0)
+    if version == 1:
+        f.read(RATE_V1.size)
+    note = f.read(length)
+    if len(note) < length:
+        raise PartialHeader(f'{f.name} ends inside its header')
+    return note.decode('utf-8', errors='replace'), -(-size//16)*16
+
+
+def records(time_us, dist):
+    # pack (time_us, distance) columns, distances beyond int16 saturate
+    block = np.empty(len(time_us), dtype=RECORD_DTYPE)
+    block['time'] = time_us
+    block['dist'] = np.clip(dist, -0x8000, 0x7fff)
+    return block
+
+
+def write_binary(fileName, note, chunks):
+    # binary counterpart of stream_recorder.save_record
+    with open(fileName, 'wb') as f:
+        f.write(header_bytes(note))
+        for t, d in chunks:
+            f.write(records(t, d).tobytes())
+
+
+def open_binary(fileName):
+    # (note, records) with the records memory-mapped, a partly written last record is ignored
+    with open(fileName, 'rb') as f:
+        note, offset = read_header(f)
+        f.seek(0, 2)
+        count = (f.tell()-offset)//RECORD_DTYPE.itemsize
+    if count <= 0:
+        return note, np.empty(0, dtype=RECORD_DTYPE)
+    return note, np.memmap(fileName, dtype=RECORD_DTYPE, mode='r', offset=offset, shape=(count,))
+
+
+def text_to_binary(src, dst, chunk_bytes=32 << 20):
+    # convert a text record file
+    with open(src, 'rb') as f_in, open(dst, 'wb') as f_out:
+        first = f_in.readline()
+        header = first.startswith(b'Distance range')
+        note = first[len(b'Distance range: '):].decode(errors='replace').strip() if header else ''
+        lines = [] if header else [first]
+        f_out.write(header_bytes(note))
+        while True:
+            lines = [line for line in lines+f_in.readlines(chunk_bytes) if line.strip()]
+            if not lines:
+                break
+            pairs = [line.split(b',') for line in lines]
+            time_us = np.array([pair[0].decode() for pair in pairs], dtype='datetime64[us]').astype('int64')
+            dist = np.array([int(pair[1]) for pair in pairs], dtype='int64')
+            f_out.write(records(time_us, dist).tobytes())
+            lines = []
+
+
+def binary_to_text(src, dst, chunk_size=1 << 20):
+    note, data = open_binary(src)
+    with open(dst, 'w') as f:
+        print(f'Distance range: {note}', file=f)
+        for start in range(0, data.size, chunk_size):
+            block = data[start:start+chunk_size]
+            f.write(format_lines(block['time'], block['dist']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert record files between the text and the binary format.')
+    parser.add_argument('files', nargs='+', help='.txt files become .swb files and .swb files become .txt files')
+    args = parser.parse_args(argv)
+    for fileName in args.files:
+        root, ext = os.path.splitext(fileName)
+        if ext == BINARY_SUFFIX:
+            binary_to_text(fileName, root+'.txt')
+        else:
+            text_to_binary(fileName, root+BINARY_SUFFIX)
+        print(f'{fileName} -> {root+(".txt" if ext == BINARY_SUFFIX else BINARY_SUFFIX)}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+import multiprocessing
+import os
+import re
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+import sheet_swing_calculation as ssc
+import history_loader
+from analysis_cache import file_identity
+
+DAILY_PATTERN = re.compile(r'^(\d{6})(_ch\d+)?\.(txt|swb)(\.gz)?$')
+
+
+class AnalysisCancelled(Exception):
+    pass
+
+
+class AnalysisPool:
+    """Worker processes kept from one analysis to the next, started when first needed."""
+
+    def __init__(self, workers=None):
+        # spawned, a forked worker would inherit the serial and recorder threads of the GUI
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = None
+
+    def submit(self, function, *args):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self.executor.submit(function, *args)
+
+    def close(self):
+        # wait for the submitted files
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def stop(self):
+        # drop the queued files and end the workers at once, the next submit starts new ones
+        if self.executor is None:
+            return
+        processes = list((self.executor._processes or {}).values())
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+        for process in processes:
+            process.terminate()
+
+
+def check_cancel(cancel):
+    if cancel is not None and cancel.is_set():
+        raise AnalysisCancelled()
+
+
+def daily_files(folder, date_from, date_to, suffix=''):
+    # daily record files (%y%m%d.txt, .swb or their archives) of one channel between two dates,
+    # both included. A day recorded in both formats gives both files, in the order they were
+    # recorded; the archive of a format is read only once its plain file is gone
+    files = {}
+    for name in sorted(os.listdir(folder)):
+        result = DAILY_PATTERN.match(name)
+        if not result or (result.group(2) or '') != suffix:
+            continue
+        try:
+            day = datetime.strptime(result.group(1), '%y%m%d').date()
+        except ValueError:
+            continue
+        if date_from <= day <= date_to:
+            # sorted names put a plain file before its archive
+            files.setdefault((day, result.group(3)), os.path.join(folder, name))
+    return [fileName for (day, ext), fileName in sorted(files.items(), key=lambda item: (item[0][0], session_start(item[1])))]
+
+
+def session_start(fileName):
+    # first recorded time of a file, unreadable and empty files first
+    try:
+        return history_loader.first_time(fileName) or 0
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def find_file_sheets(fileName, dis_from, dis_to, window=None, timestamps=False, cancel=None):
+    # runs of a file before the cycle filter. window: (from, to) times of day to analyze instead of the
+    # whole file. timestamps: segment on the recorded times, otherwise every sample counts as 1/SAMPLE_RATE.
+    # A set `cancel` event stops it between the steps
+    breaks = None
+    if window is not None:
+        time_us, swing, breaks = history_loader.load_window(fileName, *window)
+    else:
+        swing = history_loader.load_swing(fileName)
+        time_us = history_loader.load_times(fileName) if timestamps else None
+    check_cancel(cancel)
+    runs = ssc.find_sheets(swing, dis_from, dis_to, times=time_us if timestamps else None, breaks=breaks)
+    check_cancel(cancel)
+    runs.sheets = ssc.SheetSet(runs.sheets.values, runs.sheets.offsets, 'float32', runs.rate)
+    return runs
+
+
+def analyze_file(fileName, dis_from, dis_to, cycle_min, cycle_max, window=None, timestamps=False, cancel=None):
+    # cycle limits in seconds
+    runs = find_file_sheets(fileName, dis_from, dis_to, window, timestamps, cancel)
+    check_cancel(cancel)
+    return runs.filter_cycles(cycle_min, cycle_max, ragged=True, dtype='float32')
+
+
+def analyze_files(fileNames, dis_from, dis_to, cycle_min, cycle_max, workers=None, progress=None, cancel=None,
+                  window=None, timestamps=False, cache=None, pool=None):
+    # analyze every file in its own process and merge the sheets of all of them,
+    # progress(done, total) is called as files finish and a set `cancel` event stops the run.
+    # With an AnalysisCache only the files and parameters it has not seen are read. A single
+    # file is analyzed in this process; several go to `pool`, or to an AnalysisPool of `workers`
+    # for this run only
+    results = {}
+    identities = {}
+    params = (dis_from, dis_to, window, timestamps)
+    if cache is None:
+        function, args = analyze_file, (dis_from, dis_to, cycle_min, cycle_max, window, timestamps)
+    else:
+        function, args = find_file_sheets, params
+        for fileName in fileNames:
+            # the identity before the file is read, a file growing meanwhile is cached as it was
+            identities[fileName] = run_safely(file_identity, fileName)
+            if isinstance(identities[fileName], str):
+                results[fileName] = identities[fileName]
+                continue
+            result = run_safely(cache.sheets, identities[fileName], params, (cycle_min, cycle_max))
+            if result is not None:
+                results[fileName] = result
+    missing = [fileName for fileName in fileNames if fileName not in results]
+    if len(missing) == 1:
+        results[missing[0]] = run_safely(function, missing[0], *args, cancel)
+    elif missing:
+        own_pool = pool is None
+        if own_pool:
+            pool = AnalysisPool(min(workers or os.cpu_count() or 1, len(missing)))
+        try:
+            futures = {pool.submit(run_safely, function, fileName, *args): fileName for fileName in missing}
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                check_cancel(cancel)
+                for future in done:
+                    results[futures[future]] = future.result()
+                    if progress is not None:
+                        progress(len(results), len(fileNames))
+        except BaseException:
+            # cancelled or failed, the workers still busy with this run are ended
+            pool.stop()
+            raise
+        finally:
+            if own_pool:
+                pool.close()
+    if cache is not None:
+        for fileName in missing:
+            if isinstance(results[fileName], ssc.SheetRuns):
+                results[fileName] = run_safely(cache.add_runs, identities[fileName], params, (cycle_min, cycle_max),
+                                               results[fileName])
+    check_cancel(cancel)
+    summary = []
+    sheet_sets = []
+    for fileName in fileNames:
+        result = results[fileName]
+        if isinstance(result, str):
+            summary.append({'file': fileName, 'error': result})
+            continue
+        count, sheets = result
+        swing_range, avg_all, avg_first20, avg_last20, ind_first20, ind_last20 = ssc.get_swing_range(sheets, count)
+        summary.append({'file': fileName, 'count': count, 'avg_all': avg_all,
+                        'avg_first20': avg_first20, 'avg_last20': avg_last20})
+        sheet_sets.append(sheets)
+    if not sheet_sets:
+        raise ssc.SwingException(summary)
+    sheets = ssc.SheetSet.concatenate(sheet_sets)
+    return len(sheets), sheets, summary
+
+
+def run_safely(function, fileName, *args):
+    # errors are returned as text so that one bad day does not stop the others
+    try:
+        return function(fileName, *args)
+    except ssc.SwingException:
+        return 'Swing is not in the distance range or the sample is not enough.'
+    except (OSError, ValueError, IndexError):
+        return traceback.format_exc(limit=1)
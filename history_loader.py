@@ -0,0 +1,281 @@
+import glob
+import io
+import os
+import numpy as np
+from datetime import datetime
+from binary_record import BINARY_SUFFIX, RECORD_DTYPE, open_binary, read_header
+from record_archive import ARCHIVE_SUFFIX, load_index, read_blocks, read_header_member
+from sample_store import EPOCH, US_PER_DAY, to_epoch_us
+
+CACHE_FOLDER = '.cache'
+# one entry of the time index of a text file every this many lines
+TIME_INDEX_STEP = 4096
+TIME_INDEX_DTYPE = np.dtype([('time', '<i8'), ('offset', '<i8')])
+# length of '2023-03-29 10:00:00.123456'
+STAMP_WIDTH = 26
+
+
+def cache_name(fileName, tag, suffix='.npy', stamp=None):
+    # sidecar keyed by the size and mtime of the text file, stale ones are never matched.
+    # stamp: (size, mtime_ns) taken before the file was read, the current ones by default
+    if stamp is None:
+        stat = os.stat(fileName)
+        stamp = (stat.st_size, stat.st_mtime_ns)
+    folder, base = os.path.split(os.path.abspath(fileName))
+    return os.path.join(folder, CACHE_FOLDER, f'{base}.{tag}.{stamp[0]}_{stamp[1]}{suffix}')
+
+
+def load_cached(fileName, tag, parse):
+    # load an array parsed from `fileName`, through a memory-mapped .npy sidecar when possible
+    cacheName = cache_name(fileName, tag)
+    if os.path.exists(cacheName):
+        try:
+            return np.load(cacheName, mmap_mode='r')
+        except (OSError, ValueError):
+            pass
+    array = parse(fileName)
+    try:
+        os.makedirs(os.path.dirname(cacheName), exist_ok=True)
+        for stale in glob.glob(glob.escape(cacheName.split(f'.{tag}.')[0])+f'.{tag}.*.npy'):
+            os.remove(stale)
+        np.save(cacheName, array)
+    except OSError:
+        pass
+    return array
+
+
+def remove_cached(fileName):
+    # every sidecar of a file, whatever its tag and size/mtime, but not those of its archive
+    folder, base = os.path.split(os.path.abspath(fileName))
+    for cacheName in glob.glob(os.path.join(glob.escape(os.path.join(folder, CACHE_FOLDER)), glob.escape(base)+'.*')):
+        if os.path.basename(cacheName).startswith(base+ARCHIVE_SUFFIX+'.'):
+            continue
+        try:
+            os.remove(cacheName)
+        except OSError:
+            pass
+
+
+def is_binary(fileName):
+    return fileName.endswith(BINARY_SUFFIX) or fileName.endswith(BINARY_SUFFIX+ARCHIVE_SUFFIX)
+
+
+def read_note(fileName):
+    # the 'Distance range' note of a text or binary record file, compressed or not, None without one
+    if fileName.endswith(ARCHIVE_SUFFIX):
+        f = io.BytesIO(read_header_member(fileName))
+        f.name = fileName
+    else:
+        f = open(fileName, 'rb')
+    with f:
+        if is_binary(fileName):
+            return read_header(f)[0]
+        first = f.readline()
+    if first.startswith(b'Distance range: '):
+        return first[len(b'Distance range: '):].decode(errors='replace').strip()
+    return None
+
+
+def first_time(fileName):
+    # time (epoch us) of the first sample, None for an empty file
+    if fileName.endswith(ARCHIVE_SUFFIX):
+        index = load_index(fileName)
+        if index is not None:
+            return int(index['time'][0]) if index.size else None
+        time_us = next((archive_records(fileName, block)[0] for block in read_blocks(fileName)), np.empty(0))
+    elif is_binary(fileName):
+        time_us = open_binary(fileName)[1]['time'][:1]
+    else:
+        with open(fileName, 'rb') as f:
+            time_us = parse_records(b''.join(f.readline() for i in range(2)))[0][:1]
+    return int(time_us[0]) if len(time_us) else None
+
+
+def day_ranges(day_us, time_from, time_to):
+    # epoch us ranges of a time of day window in the day starting at `day_us`,
+    # a window ending before it starts covers the end and the beginning of the day
+    start = day_us+to_epoch_us(datetime.combine(EPOCH.date(), time_from))
+    stop = day_us+to_epoch_us(datetime.combine(EPOCH.date(), time_to))
+    if stop > start:
+        return [(start, stop)]
+    return [(day_us, stop), (start, day_us+US_PER_DAY)]
+
+
+def load_window(fileName, time_from, time_to):
+    # (time_us, distance, breaks) between two times of day (datetime.time) of the day of the file.
+    # breaks: index of the first sample after a jump in time, where a window past midnight joins
+    # the beginning and the end of the day
+    first = first_time(fileName)
+    if first is None:
+        return np.empty(0, dtype='int64'), np.empty(0, dtype='int32'), np.empty(0, dtype='int64')
+    ranges = day_ranges(first-first % US_PER_DAY, time_from, time_to)
+    parts = [load_range(fileName, start, stop) for start, stop in ranges]
+    sizes = np.cumsum([t.size for t, d in parts])[:-1]
+    joined = np.array([start == stop for (_, stop), (start, _) in zip(ranges[:-1], ranges[1:])], dtype=bool)
+    return np.concatenate([t for t, d in parts]), np.concatenate([d for t, d in parts]), sizes[~joined]
+
+
+def load_swing(fileName, cache=True):
+    # distance column of a history record file, binary records are mapped as they are
+    # and compressed archives are read block by block, without a sidecar larger than the archive
+    if fileName.endswith(BINARY_SUFFIX):
+        return open_binary(fileName)[1]['dist']
+    if cache and not fileName.endswith(ARCHIVE_SUFFIX):
+        return load_cached(fileName, 'swing', parse_swing)
+    return parse_swing(fileName)
+
+
+def load_times(fileName, cache=True):
+    # time column (epoch us) of a history record file, sample by sample with load_swing
+    if fileName.endswith(BINARY_SUFFIX):
+        return open_binary(fileName)[1]['time']
+    if cache and not fileName.endswith(ARCHIVE_SUFFIX):
+        return load_cached(fileName, 'stamps', parse_times)
+    return parse_times(fileName)
+
+
+def parse_times(fileName):
+    if fileName.endswith(ARCHIVE_SUFFIX):
+        time_us = [archive_records(fileName, block)[0] for block in read_blocks(fileName)]
+        return np.concatenate(time_us) if time_us else np.empty(0, dtype='int64')
+    with open(fileName, 'rb') as f:
+        return parse_records(f.read())[0]
+
+
+def parse_swing(fileName):
+    if fileName.endswith(ARCHIVE_SUFFIX):
+        return parse_archive(fileName)
+    with open(fileName, 'rb') as f:
+        buf = f.read()
+    if buf.startswith(b'Distance range'):
+        buf = buf[buf.find(b'\n')+1:] if b'\n' in buf else b''
+    return parse_lines(buf)
+
+
+def parse_archive(fileName):
+    # decompress and parse one block at a time, only the distances are kept in memory
+    if is_binary(fileName):
+        swing = [np.frombuffer(block, dtype=RECORD_DTYPE)['dist'].astype('int32') for block in read_blocks(fileName)]
+    else:
+        swing = [parse_lines(block) for block in read_blocks(fileName)]
+    return np.concatenate(swing) if swing else np.empty(0, dtype='int32')
+
+
+def parse_lines(buf):
+    swing = parse_distance(buf)
+    if swing is None:
+        # irregular lines, parse them one by one
+        swing = np.array([int(line.split(b',')[1]) for line in buf.splitlines() if line.strip()], dtype='int32')
+    return swing
+
+
+def parse_records(buf):
+    # (time_us, distance) of every line, vectorized when the times have the fixed width the recorder writes
+    if buf.startswith(b'Distance range'):
+        buf = buf[buf.find(b'\n')+1:] if b'\n' in buf else b''
+    data = np.frombuffer(buf, dtype=np.uint8)
+    starts, ends = line_bounds(data)
+    swing = parse_distance(buf)
+    if (swing is not None and starts.size and np.all(ends-starts > STAMP_WIDTH)
+            and np.all(data[starts+STAMP_WIDTH] == ord(','))):
+        stamps = np.ascontiguousarray(data[starts[:, None]+np.arange(STAMP_WIDTH)]).view(f'S{STAMP_WIDTH}').ravel()
+        return stamps.astype('datetime64[us]').astype('int64'), swing
+    pairs = [line.split(b',') for line in buf.splitlines() if line.strip()]
+    time_us = np.array([pair[0].decode().strip() for pair in pairs], dtype='datetime64[us]').astype('int64')
+    return time_us, np.array([int(pair[1]) for pair in pairs], dtype='int32')
+
+
+def archive_records(fileName, block):
+    # (time_us, distance) of a decompressed archive block
+    if is_binary(fileName):
+        records = np.frombuffer(block, dtype=RECORD_DTYPE)
+        return records['time'], records['dist'].astype('int32')
+    return parse_records(block)
+
+
+def build_time_index(fileName):
+    # time and byte offset of every TIME_INDEX_STEP-th line of a text record file
+    with open(fileName, 'rb') as f:
+        buf = f.read()
+    starts, ends = line_bounds(np.frombuffer(buf, dtype=np.uint8))
+    if buf.startswith(b'Distance range'):
+        starts, ends = starts[1:], ends[1:]
+    starts, ends = starts[::TIME_INDEX_STEP], ends[::TIME_INDEX_STEP]
+    index = np.empty(starts.size, dtype=TIME_INDEX_DTYPE)
+    index['time'] = np.array([buf[start:end].split(b',')[0].decode().strip() for start, end in zip(starts, ends)],
+                             dtype='datetime64[us]').astype('int64')
+    index['offset'] = starts
+    return index
+
+
+def load_text_range(fileName, time_from, time_to):
+    # parse only the lines of the indexed blocks around the range
+    index = load_cached(fileName, 'time', build_time_index)
+    first = 0 if time_from is None else max(int(np.searchsorted(index['time'], time_from))-1, 0)
+    last = index.size if time_to is None else int(np.searchsorted(index['time'], time_to))
+    with open(fileName, 'rb') as f:
+        if index.size == 0:
+            return parse_records(f.read())
+        f.seek(index['offset'][first])
+        if last < index.size:
+            return parse_records(f.read(index['offset'][last]-index['offset'][first]))
+        return parse_records(f.read())
+
+
+def load_range(fileName, time_from=None, time_to=None):
+    # (time_us, distance) of the samples with time_from <= time < time_to (epoch us), text files
+    # are read through a cached time index and compressed archives through their block index
+    if fileName.endswith(ARCHIVE_SUFFIX):
+        parts = [archive_records(fileName, block) for block in read_blocks(fileName, time_from, time_to)]
+        time_us = np.concatenate([t for t, d in parts]) if parts else np.empty(0, dtype='int64')
+        swing = np.concatenate([d for t, d in parts]) if parts else np.empty(0, dtype='int32')
+    elif is_binary(fileName):
+        records = open_binary(fileName)[1]
+        time_us, swing = records['time'], records['dist']
+    else:
+        try:
+            time_us, swing = load_text_range(fileName, time_from, time_to)
+        except ValueError:
+            # lines without a readable time, parse the whole file
+            with open(fileName, 'rb') as f:
+                time_us, swing = parse_records(f.read())
+    start = 0 if time_from is None else np.searchsorted(time_us, time_from)
+    stop = time_us.size if time_to is None else np.searchsorted(time_us, time_to)
+    return np.asarray(time_us[start:stop]), np.asarray(swing[start:stop], dtype='int32')
+
+
+def line_bounds(data):
+    # start and end (without '\r\n') of every non empty line
+    ends = np.flatnonzero(data == ord('\n'))
+    if data.size and data[-1] != ord('\n'):
+        ends = np.append(ends, data.size)
+    starts = np.insert(ends[:-1]+1, 0, 0)
+    cr = np.zeros(ends.size, dtype=bool)
+    cr[ends > starts] = data[ends[ends > starts]-1] == ord('\r')
+    ends = ends-cr
+    keep = ends > starts
+    return starts[keep], ends[keep]
+
+
+def parse_distance(buf):
+    # vectorized parse of the integer after the only comma of each line, None if a line does not fit
+    data = np.frombuffer(buf, dtype=np.uint8)
+    starts, ends = line_bounds(data)
+    if starts.size == 0:
+        return np.empty(0, dtype='int32')
+    commas = np.flatnonzero(data == ord(','))
+    if commas.size != starts.size:
+        return None
+    if np.any(commas < starts) or np.any(commas >= ends):
+        return None
+    length = ends-commas-1
+    if length.min() < 1 or length.max() > 9:
+        return None
+    swing = np.zeros(starts.size, dtype='int64')
+    for k in range(length.max()):
+        more = length > k
+        digit = data[np.where(more, commas+1+k, 0)].astype('int64')-ord('0')
+        if np.any(more & ((digit < 0) | (digit > 9))):
+            return None
+        swing = np.where(more, swing*10+digit, swing)
+    return swing.astype('int32')
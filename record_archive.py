@@ -0,0 +1,169 @@
+import argparse
+import logging
+import os
+import re
+import sys
+import traceback
+import zlib
+from datetime import date, datetime, timedelta
+from itertools import islice
+import numpy as np
+from binary_record import BINARY_SUFFIX, RECORD_DTYPE, read_header
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SUFFIX = '.gz'
+ARCHIVE_PATTERN = re.compile(r'^(\d{6})(_ch\d+)?\.(txt|swb)$')
+# first time (epoch us), file offset and sample count of every compressed block
+INDEX_DTYPE = np.dtype([('time', '<i8'), ('offset', '<i8'), ('count', '<i8')])
+
+
+def index_name(archive):
+    # in the cache folder with the other sidecars
+    from history_loader import CACHE_FOLDER
+    folder, base = os.path.split(os.path.abspath(archive))
+    return os.path.join(folder, CACHE_FOLDER, base+'.idx.npy')
+
+
+def compress_member(data, level):
+    # one complete gzip member, a gzip reader sees the members as one stream
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data)+compressor.flush()
+
+
+def line_time(line):
+    return np.datetime64(line.split(b',')[0].decode().strip(), 'us').astype('int64')
+
+
+def archive_file(fileName, block_size=65536, level=6, remove=True):
+    # compress a text or binary record file into gzip members of `block_size` samples each, the header
+    # in a member of its own, and save the index of the blocks next to it
+    archive = fileName+ARCHIVE_SUFFIX
+    index = []
+    try:
+        with open(fileName, 'rb') as f_in, open(archive+'.part', 'wb') as f_out:
+            if fileName.endswith(BINARY_SUFFIX):
+                offset = read_header(f_in)[1]
+                f_in.seek(0)
+                f_out.write(compress_member(f_in.read(offset), level))
+                while True:
+                    data = f_in.read(block_size*RECORD_DTYPE.itemsize)
+                    count = len(data)//RECORD_DTYPE.itemsize
+                    if count == 0:
+                        break
+                    index.append((np.frombuffer(data, dtype=RECORD_DTYPE, count=1)['time'][0], f_out.tell(), count))
+                    f_out.write(compress_member(data[:count*RECORD_DTYPE.itemsize], level))
+            else:
+                first = f_in.readline()
+                if first.startswith(b'Distance range'):
+                    f_out.write(compress_member(first, level))
+                else:
+                    f_in.seek(0)
+                while True:
+                    lines = list(islice(f_in, block_size))
+                    if not lines:
+                        break
+                    lines = [line for line in lines if line.strip()]
+                    if lines:
+                        index.append((line_time(lines[0]), f_out.tell(), len(lines)))
+                        f_out.write(compress_member(b''.join(lines), level))
+    except (OSError, ValueError):
+        if os.path.exists(archive+'.part'):
+            os.remove(archive+'.part')
+        raise
+    os.replace(archive+'.part', archive)
+    os.makedirs(os.path.dirname(index_name(archive)), exist_ok=True)
+    np.save(index_name(archive), np.array(index, dtype=INDEX_DTYPE))
+    if remove:
+        os.remove(fileName)
+        # the loader caches of the plain file would never be matched again
+        from history_loader import remove_cached
+        remove_cached(fileName)
+    return archive
+
+
+def load_index(archive):
+    try:
+        return np.load(index_name(archive))
+    except (OSError, ValueError):
+        return None
+
+
+def iter_members(f, chunk_size=1 << 20):
+    # decompressed gzip members of an open archive, read as a stream
+    decompressor = zlib.decompressobj(31)
+    parts = []
+    while True:
+        buf = f.read(chunk_size)
+        if not buf:
+            break
+        while buf:
+            parts.append(decompressor.decompress(buf))
+            if not decompressor.eof:
+                break
+            yield b''.join(parts)
+            parts = []
+            buf = decompressor.unused_data
+            decompressor = zlib.decompressobj(31)
+    if any(parts):
+        yield b''.join(parts)
+
+
+def read_header_member(archive):
+    with open(archive, 'rb') as f:
+        return next(iter_members(f), b'')
+
+
+def read_blocks(archive, time_from=None, time_to=None):
+    # decompressed blocks that may hold samples between two times (epoch us), through the index;
+    # every block when there is no index
+    index = load_index(archive)
+    with open(archive, 'rb') as f:
+        if index is None:
+            members = iter_members(f)
+            next(members, None)    # header
+            yield from members
+            return
+        start = 0 if time_from is None else max(int(np.searchsorted(index['time'], time_from, 'right'))-1, 0)
+        stop = index.size if time_to is None else int(np.searchsorted(index['time'], time_to, 'right'))
+        f.seek(0, 2)
+        ends = np.append(index['offset'][1:], f.tell())
+        for k in range(start, stop):
+            f.seek(index['offset'][k])
+            yield zlib.decompress(f.read(ends[k]-index['offset'][k]), 31)
+
+
+def archive_days(folder, before, block_size=65536):
+    # compress the daily record files of the days before `before`, return the archives made
+    archives = []
+    for name in sorted(os.listdir(folder)):
+        result = ARCHIVE_PATTERN.match(name)
+        if not result:
+            continue
+        try:
+            day = datetime.strptime(result.group(1), '%y%m%d').date()
+        except ValueError:
+            continue
+        if day < before:
+            try:
+                archives.append(archive_file(os.path.join(folder, name), block_size))
+            except (OSError, ValueError):
+                logger.error(f'{traceback.format_exc()}')
+    if archives:
+        logger.info(f'Archived {len(archives)} record file(s) in {folder}')
+    return archives
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compress the daily record files of completed days.')
+    parser.add_argument('folder', help='folder of the daily record files')
+    parser.add_argument('--keep', type=int, default=1, help='days kept uncompressed before today, default 1')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    for archive in archive_days(args.folder, date.today()-timedelta(days=args.keep)):
+        print(archive)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
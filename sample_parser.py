@@ -0,0 +1,42 @@
+import re
+import numpy as np
+
+SAMPLE_PATTERN = re.compile(rb'\$,(\d+)$')
+# longest partial line kept between reads, a sensor line is about 10 bytes
+MAX_LINE = 256
+
+
+class SampleParser:
+    """Turn raw '$,<distance>' lines from the sensor into typed samples."""
+
+    def __init__(self):
+        self.buffer = b''
+        self.good = 0
+        self.malformed = 0
+
+    def parse_line(self, line):
+        # distance of one raw line, None when the format is wrong
+        result_raw = SAMPLE_PATTERN.match(line.strip())
+        if result_raw:
+            self.good += 1
+            return int(result_raw.group(1))
+        self.malformed += 1
+        return None
+
+    def feed(self, data, time_us):
+        # parse every complete line in `data`, keeping a partial last line for the next call
+        self.buffer += data
+        *lines, self.buffer = self.buffer.split(b'\n')
+        if len(self.buffer) > MAX_LINE:
+            # no line end for too long, e.g. a wrong baud rate: drop the bytes as one malformed line
+            lines.append(self.buffer)
+            self.buffer = b''
+        block_dis = []
+        wrong = []
+        for line in lines:
+            dis = self.parse_line(line)
+            if dis is None:
+                wrong.append(line.strip().decode(errors='replace'))
+            else:
+                block_dis.append(dis)
+        return np.full(len(block_dis), time_us, dtype='int64'), np.array(block_dis, dtype='int32'), wrong
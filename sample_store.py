@@ -0,0 +1,96 @@
+import bisect
+import numpy as np
+from datetime import datetime, timedelta
+
+EPOCH = datetime(1970, 1, 1)
+US_PER_DAY = 86400*10**6
+SAMPLE_RATE = 10    # samples per second of the sensor
+
+
+def to_epoch_us(time):
+    return (time - EPOCH)//timedelta(microseconds=1)
+
+
+def format_lines(time_us, dist):
+    # '2023-03-29 10:00:00.123456,512' for every sample, the times formatted column-wise
+    stamps = np.datetime_as_string(np.asarray(time_us).astype('datetime64[us]'), unit='us').tolist()
+    return ''.join([f'{stamp},{value}\n' for stamp, value in zip(stamps, np.asarray(dist).tolist())]).replace('T', ' ')
+
+
+class SampleStore:
+    """Append-only store of (time, distance) samples kept in preallocated chunks."""
+
+    def __init__(self, chunk_size=65536):
+        self.chunk_size = chunk_size
+        self.clear()
+
+    def clear(self):
+        self._time = [np.empty(self.chunk_size, dtype='int64')]
+        self._dist = [np.empty(self.chunk_size, dtype='int32')]
+        self._head = 0  # first valid index of the first chunk
+        self._fill = 0  # used length of the last chunk
+
+    def __len__(self):
+        return (len(self._time)-1)*self.chunk_size+self._fill-self._head
+
+    def append(self, time, dist):
+        if self._fill == self.chunk_size:
+            self._time.append(np.empty(self.chunk_size, dtype='int64'))
+            self._dist.append(np.empty(self.chunk_size, dtype='int32'))
+            self._fill = 0
+        self._time[-1][self._fill] = to_epoch_us(time)
+        self._dist[-1][self._fill] = dist
+        self._fill += 1
+
+    def extend(self, time_us, dist):
+        # append a block of samples with epoch-microsecond timestamps
+        done = 0
+        while done < len(time_us):
+            if self._fill == self.chunk_size:
+                self._time.append(np.empty(self.chunk_size, dtype='int64'))
+                self._dist.append(np.empty(self.chunk_size, dtype='int32'))
+                self._fill = 0
+            n = min(len(time_us)-done, self.chunk_size-self._fill)
+            self._time[-1][self._fill:self._fill+n] = time_us[done:done+n]
+            self._dist[-1][self._fill:self._fill+n] = dist[done:done+n]
+            self._fill += n
+            done += n
+
+    def chunks(self, count=None):
+        # yield (time_us, distance) views of the first `count` samples in order, without copying
+        remain = len(self) if count is None else count
+        last = len(self._time)-1
+        for i in range(last+1):
+            if remain <= 0:
+                break
+            start = self._head if i == 0 else 0
+            stop = min(self._fill if i == last else self.chunk_size, start+remain)
+            if stop > start:
+                yield self._time[i][start:stop], self._dist[i][start:stop]
+                remain -= stop-start
+
+    def split_index(self, time):
+        # number of samples before `time`, by bisecting the chunk heads then the chunk
+        time_us = to_epoch_us(time)
+        views = list(self.chunks())
+        heads = [t[0] for t, d in views]
+        i = bisect.bisect_left(heads, time_us)-1
+        if i < 0:
+            return 0
+        return sum(t.size for t, d in views[:i])+int(np.searchsorted(views[i][0], time_us))
+
+    def drop_front(self, count):
+        count = min(count, len(self))
+        self._head += count
+        while len(self._time) > 1 and self._head >= self.chunk_size:
+            del self._time[0]
+            del self._dist[0]
+            self._head -= self.chunk_size
+        if len(self._time) == 1 and self._head >= self._fill:
+            self.clear()
+
+    def take_front(self, count):
+        # detach the first `count` samples, the views stay valid as appends never overwrite them
+        views = list(self.chunks(count))
+        self.drop_front(count)
+        return views
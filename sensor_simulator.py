@@ -0,0 +1,116 @@
+"""Simulated distance sensor on a pseudo terminal (Linux), for testing the acquisition without hardware.
+
+python sensor_simulator.py --rate 100 --malformed 0.01 --silence 60 5
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import tty
+import numpy as np
+from signal_generator import SAMPLE_RATE, generate_swing
+
+MALFORMED_LINES = [b'$,', b'$,4a7', b'#,512', b'$512', b'$,,433', b'\x00\xff$,4']
+
+
+class VirtualSensor(threading.Thread):
+    """Write '$,<distance>' lines to a pseudo terminal at a given rate."""
+
+    def __init__(self, rate=SAMPLE_RATE, values=None, burst=1, malformed=0.0, silence=(0, 0), seed=0):
+        # values: distances sent in a loop, a synthetic swing by default, or 'counter' to send
+        # the sample number so that a reader can find dropped samples and the latency of each one.
+        # burst: lines written at once, the average rate is kept. malformed: share of extra garbage
+        # lines. silence: (every, for) seconds without any output
+        super(VirtualSensor, self).__init__(daemon=True)
+        self.rate = rate
+        self.counter = isinstance(values, str) and values == 'counter'
+        self.values = None if self.counter else np.asarray(generate_swing(36000, seed=seed) if values is None else values)
+        self.burst = burst
+        self.malformed = malformed
+        self.silence = silence
+        self.rng = np.random.default_rng(seed)
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        # like a UART the sensor never waits for the reader, what does not fit is lost
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        self.sent = 0
+        self.sent_malformed = 0
+        self.overrun_bytes = 0
+        self.send_times = []    # scheduled monotonic time of every sample
+        self.active = False
+
+    def silent(self, elapsed):
+        every, duration = self.silence
+        return every > 0 and elapsed % every >= every-duration
+
+    def lines(self, count):
+        # the next `count` samples, with garbage lines mixed in
+        lines = []
+        for k in range(self.sent, self.sent+count):
+            if self.malformed and self.rng.random() < self.malformed:
+                lines.append(MALFORMED_LINES[self.rng.integers(len(MALFORMED_LINES))])
+                self.sent_malformed += 1
+            lines.append(b'$,%d' % (k if self.counter else self.values[k % self.values.size]))
+        return b''.join(line+b'\r\n' for line in lines)
+
+    def run(self):
+        self.active = True
+        start = time.monotonic()
+        due = start
+        while self.active:
+            delay = due-time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if self.silent(due-start):
+                due += self.burst/self.rate
+                continue
+            data = self.lines(self.burst)
+            self.send_times.extend(due+np.arange(self.burst)/self.rate)
+            self.sent += self.burst
+            try:
+                self.overrun_bytes += len(data)-os.write(self.master, data)
+            except BlockingIOError:
+                self.overrun_bytes += len(data)
+            except OSError:
+                break
+            due += self.burst/self.rate
+        self.active = False
+
+    def stop(self):
+        self.active = False
+        if self.is_alive():
+            self.join()
+
+    def close(self):
+        self.stop()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate the distance sensor on a pseudo terminal.')
+    parser.add_argument('--rate', type=float, default=SAMPLE_RATE, help='samples per second, default 10')
+    parser.add_argument('--burst', type=int, default=1, help='samples written at once')
+    parser.add_argument('--malformed', type=float, default=0.0, help='share of extra malformed lines')
+    parser.add_argument('--silence', type=float, nargs=2, default=(0, 0), metavar=('EVERY', 'FOR'),
+                        help='stay silent FOR seconds out of every EVERY seconds')
+    parser.add_argument('--counter', action='store_true', help='send the sample number instead of a swing signal')
+    args = parser.parse_args(argv)
+
+    sensor = VirtualSensor(args.rate, 'counter' if args.counter else None, args.burst, args.malformed, tuple(args.silence))
+    sensor.start()
+    print(f'Simulated sensor on {sensor.port}, Ctrl+C to stop', flush=True)
+    try:
+        while sensor.is_alive():
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    sensor.close()
+    print(f'{sensor.sent} samples, {sensor.sent_malformed} malformed lines sent, {sensor.overrun_bytes} bytes lost')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
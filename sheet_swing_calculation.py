@@ -1,23 +1,149 @@
+import bisect
 import numpy as np
+from collections import deque
+from sample_store import SAMPLE_RATE
 
 class SwingException(Exception):
     pass
 
-def get_each_sheet(swing, dis_from, dis_to, cycle_min, cycle_max):
+class SheetSet:
+    # Flat values of every sheet, sheet i is values[offsets[i]:offsets[i+1]], sampled at `rate`
+    # (samples per second, None for sheets of different rates)
+    def __init__(self, values, offsets, dtype=None, rate=SAMPLE_RATE):
+        self.values = values if dtype is None else values.astype(dtype)
+        self.offsets = offsets
+        self.rate = rate
+
+    def __len__(self):
+        return self.offsets.size-1
+
+    @property
+    def cycles(self):
+        return np.diff(self.offsets)
+
+    def max(self):
+        return np.maximum.reduceat(self.values, self.offsets[:-1])
+
+    def min(self):
+        return np.minimum.reduceat(self.values, self.offsets[:-1])
+
+    def positions(self):
+        # Index of every value inside its own sheet
+        return np.arange(self.values.size)-np.repeat(self.offsets[:-1], self.cycles)
+
+    def select(self, index):
+        # Sheets picked by index, in the given order
+        index = np.atleast_1d(np.arange(len(self))[index])
+        cycles = self.cycles[index]
+        offsets = np.insert(cycles.cumsum(), 0, 0)
+        take = np.arange(offsets[-1])-np.repeat(offsets[:-1]-self.offsets[index], cycles)
+        return SheetSet(self.values[take], offsets, rate=self.rate)
+
+    @classmethod
+    def concatenate(cls, sheet_sets):
+        values = np.concatenate([sheets.values for sheets in sheet_sets])
+        cycles = np.concatenate([sheets.cycles for sheets in sheet_sets])
+        rates = {sheets.rate for sheets in sheet_sets}
+        return cls(values, np.insert(cycles.cumsum(), 0, 0), rate=rates.pop() if len(rates) == 1 else None)
+
+def estimate_rate(times):
+    # Samples per second from the timestamps (us), the samples read at once share one timestamp.
+    # Rounded to 0.01 Hz so that the jitter of the timestamps does not move the cycle limits
+    starts = np.flatnonzero(np.diff(times, prepend=times[0]-1))
+    if starts.size < 2:
+        return SAMPLE_RATE
+    counts = np.diff(np.append(starts, times.size))
+    return round(float(np.median(counts[1:]/np.diff(times[starts])))*1e6, 2)
+
+def sample_slots(times, rate):
+    # Step of every sample on a uniform 1/rate grid: where its timestamp puts it but at least one step
+    # after the previous sample, so the samples of one read keep their order and missing samples leave holes
+    steps = np.rint((times-times[0])*(rate/1e6)).astype('int64')-np.arange(times.size)
+    return np.arange(times.size)+np.maximum.accumulate(steps)
+
+class SheetRuns:
+    # Runs in the distance range before the cycle filter: the data of every run without its first
+    # and last data, the full cycle of every run (samples at rate) and whether it is an inner run,
+    # neither the first nor the last of a part between gaps
+    def __init__(self, sheets, cycles, inner, rate):
+        self.sheets = sheets
+        self.cycles = cycles
+        self.inner = inner
+        self.rate = rate
+
+    @property
+    def nbytes(self):
+        return self.sheets.values.nbytes+self.sheets.offsets.nbytes+self.cycles.nbytes+self.inner.nbytes
+
+    def filter_cycles(self, cycle_min, cycle_max, ragged=False, dtype=None):
+        # Remove the first and the last sheet of every part and short/long cycles, cycle limits in seconds
+        return self.filter_samples(cycle_min*self.rate, cycle_max*self.rate, ragged, dtype)
+
+    def filter_samples(self, cycle_min, cycle_max, ragged=False, dtype=None):
+        # filter_cycles with the cycle limits in samples at rate
+        remain_bool = (self.inner & (self.cycles > cycle_min) & (self.cycles < cycle_max)
+                       & (self.sheets.cycles > 0))
+        if not remain_bool.any():
+            raise SwingException(remain_bool)
+        sheets = self.sheets.select(np.flatnonzero(remain_bool))
+        if ragged:
+            return len(sheets), SheetSet(sheets.values, sheets.offsets, dtype, self.rate)
+        return len(sheets), overlap_sheets(sheets.values, sheets.offsets)
+
+def get_each_sheet(swing, dis_from, dis_to, cycle_min, cycle_max, ragged=False, dtype=None,
+                   times=None, rate=None, max_gap=1.0):
+    # cycle_min/cycle_max are in samples at rate (1/SAMPLE_RATE s each by default), see find_sheets for the rest
+    return find_sheets(swing, dis_from, dis_to, times, rate, max_gap).filter_samples(cycle_min, cycle_max, ragged, dtype)
+
+def find_sheets(swing, dis_from, dis_to, times=None, rate=None, max_gap=1.0, breaks=None):
+    # Everything of get_each_sheet up to the cycle filter, so that other cycle limits reuse it.
+    # Without `times` every sample counts as 1/rate seconds (SAMPLE_RATE by default). With the
+    # timestamps (epoch us) the samples are put on a uniform grid at `rate`, estimated from the
+    # timestamps by default: gaps up to max_gap seconds are filled with the previous sample and
+    # longer gaps split the data like the start and the end of the record. `breaks`, indices of
+    # the samples that follow a jump in the data, split it the same way in both modes
+    part = np.zeros(len(swing), dtype='int64')
+    if breaks is not None:
+        part = np.searchsorted(np.asarray(breaks, dtype='int64'), np.arange(len(swing)), 'right')
     swing = np.array(swing, dtype="float64")
+    if times is not None:
+        times = np.asarray(times, dtype='int64')
+        if rate is None and times.size:
+            rate = estimate_rate(times)
+    if rate is None:
+        rate = SAMPLE_RATE
     # Filter noise
     swing[swing < dis_from] = np.nan
     idx = np.where(~np.isnan(swing),np.arange(swing.size),0)
     np.maximum.accumulate(idx, axis=0, out=idx)
     swing = swing[idx]
-    swing = swing[~np.isnan(swing)]
+    valid_bool = ~np.isnan(swing)
+    swing = swing[valid_bool]
+    part = part[valid_bool]
     if swing.size == 0:
         raise SwingException(swing)
-    
+
+    # Put the samples on the time grid, a break leaves a hole of at least one sample
+    if times is None:
+        serial_count = np.arange(swing.size)+part
+        segment = part
+    else:
+        serial_count = sample_slots(times[valid_bool], rate)+part
+        hole = np.diff(serial_count)-1
+        split_bool = (hole > max_gap*rate) | (np.diff(part) > 0)
+        segment = np.insert(split_bool.cumsum(), 0, 0)
+        fill = np.where(split_bool, 0, hole)
+        if fill.any():
+            repeat = np.append(fill+1, 1)
+            start = np.insert(repeat.cumsum(), 0, 0)[:-1]
+            swing = np.repeat(swing, repeat)
+            segment = np.repeat(segment, repeat)
+            serial_count = np.repeat(serial_count, repeat)+np.arange(swing.size)-np.repeat(start, repeat)
+
     # Remain the data in the range
-    serial_count = np.arange(swing.size)
     in_range_bool = (swing >= dis_from) & (swing <= dis_to)
     serial_count = serial_count[in_range_bool]
+    segment = segment[in_range_bool]
     swing = swing[in_range_bool]
     if swing.size == 0:
         raise SwingException(swing)
@@ -26,6 +152,7 @@ def get_each_sheet(swing, dis_from, dis_to, cycle_min, cycle_max):
     opening = np.diff(serial_count, prepend=0)
     sheet_serial = np.cumsum(opening != 1)
     sheet_count, opening_index, sheet_cycle = np.unique(sheet_serial, return_index=True, return_counts=True)
+    sheet_segment = segment[opening_index]
     
     # Remove the first and the last data of every sheet
     ending_index = opening_index-1
@@ -33,29 +160,30 @@ def get_each_sheet(swing, dis_from, dis_to, cycle_min, cycle_max):
     swing = np.delete(swing, np.concatenate([opening_index, ending_index]))
     sheet_serial = np.delete(sheet_serial, np.concatenate([opening_index, ending_index]))
     
-    # Remove the first sheet, the last sheet and short/long cycles
-    sheet_count = np.delete(sheet_count, [0, -1])
-    sheet_cycle = np.delete(sheet_cycle, [0, -1])
-    sheet_remain_bool = np.in1d(sheet_serial, sheet_count[(sheet_cycle > cycle_min) & (sheet_cycle < cycle_max)])
-    swing = swing[sheet_remain_bool]
-    sheet_serial = sheet_serial[sheet_remain_bool]
-    if swing.size == 0:
-        raise SwingException(swing)
+    # Mark the first and the last sheet of every part between gaps
+    inner_bool = np.zeros(sheet_count.size, dtype=bool)
+    inner_bool[1:-1] = (sheet_segment[1:-1] == sheet_segment[:-2]) & (sheet_segment[1:-1] == sheet_segment[2:])
     
-    # Overlap every sheet
-    sheet_count, sheet_cycle = np.unique(sheet_serial, return_counts=True)
-    sheet_cycle_cum = sheet_cycle.cumsum()
+    # Group the remaining data by sheet, a sheet of one or two data is left empty
+    sheet_cycle_cum = np.bincount(sheet_serial-sheet_count[0], minlength=sheet_count.size).cumsum()
     sheet_cycle_cum = np.insert(sheet_cycle_cum, 0, 0)
-    swing_overlap = np.empty((sheet_cycle.max(), sheet_count.size))
+    return SheetRuns(SheetSet(swing, sheet_cycle_cum, rate=rate), sheet_cycle, inner_bool, rate)
+
+def overlap_sheets(swing, offsets):
+    # Scatter the sheets into the columns of a NaN padded matrix
+    sheet_cycle = np.diff(offsets)
+    column = np.repeat(np.arange(sheet_cycle.size), sheet_cycle)
+    row = np.arange(swing.size)-np.repeat(offsets[:-1], sheet_cycle)
+    swing_overlap = np.empty((sheet_cycle.max(), sheet_cycle.size))
     swing_overlap.fill(np.nan)
-    for i in range(sheet_cycle.size):
-        swing_overlap[:sheet_cycle[i],i] = swing[sheet_cycle_cum[i]:sheet_cycle_cum[i+1]].copy()
-        
-    # Return
-    return sheet_count.size, swing_overlap
+    swing_overlap[row, column] = swing
+    return swing_overlap
 
 def get_swing_range(swing_overlap, count):
-    swing_range = np.nanmax(swing_overlap, axis=0)-np.nanmin(swing_overlap, axis=0)
+    if isinstance(swing_overlap, SheetSet):
+        swing_range = swing_overlap.max().astype('float64')-swing_overlap.min()
+    else:
+        swing_range = np.nanmax(swing_overlap, axis=0)-np.nanmin(swing_overlap, axis=0)
     avg_all = swing_range.mean()
     count_20 = round(count*0.2)
     if count_20 > 0:
@@ -70,3 +198,149 @@ def get_swing_range(swing_overlap, count):
         avg_last20 = 'NA'
     return swing_range, avg_all, avg_first20, avg_last20, ind_first20, ind_last20
 
+
+class SheetDetector:
+    # Streaming version of get_each_sheet/get_swing_range. A sheet is reported once the next
+    # sheet starts, so the first and the last sheet of a stream are dropped like in the batch.
+    # The cycle limits are in seconds, counted in samples at `rate`
+    def __init__(self, dis_from, dis_to, cycle_min, cycle_max, rate=SAMPLE_RATE):
+        self.dis_from = dis_from
+        self.dis_to = dis_to
+        self.cycle_min = cycle_min*rate
+        self.cycle_max = cycle_max*rate
+        self.last_valid = None
+        self.run_count = 0
+        self.run_cycle = 0
+        self.run_time = None
+        self.pending = None
+        self.count = 0
+
+    def update(self, value, time=None):
+        # Feed one sample, return the completed sheet or None
+        sheet = None
+        # Filter noise
+        if value < self.dis_from:
+            if self.last_valid is None:
+                return None
+            value = self.last_valid
+        self.last_valid = value
+        if value <= self.dis_to:
+            if self.run_cycle == 0:
+                sheet = self.start_run(time)
+            self.run_cycle += 1
+            # The first and the last data of every sheet are left out
+            if self.run_cycle == 3:
+                self.run_max = self.run_min = self.held
+            elif self.run_cycle > 3:
+                self.run_max = max(self.run_max, self.held)
+                self.run_min = min(self.run_min, self.held)
+            self.held = value
+        elif self.run_cycle:
+            self.close_run()
+        return sheet
+
+    def update_block(self, values, times=None):
+        sheets = []
+        for i, value in enumerate(values):
+            sheet = self.update(value, None if times is None else times[i])
+            if sheet is not None:
+                sheets.append(sheet)
+        return sheets
+
+    def start_run(self, time):
+        sheet = self.pending
+        if sheet is not None:
+            self.count += 1
+            sheet['count'] = self.count
+        self.pending = None
+        self.run_time = time
+        return sheet
+
+    def close_run(self):
+        # Remove the first sheet and short/long cycles
+        if self.run_count and self.run_cycle >= 3 and self.cycle_min < self.run_cycle < self.cycle_max:
+            self.pending = {'swing': float(self.run_max-self.run_min), 'cycle': self.run_cycle, 'time': self.run_time}
+        self.run_count += 1
+        self.run_cycle = 0
+
+class RollingSwingStats:
+    # Live version of get_swing_range over the last max_count sheets and/or max_age microseconds.
+    # The sheets are kept sorted with the sums of the top and bottom 20% maintained at their
+    # boundaries, so a new sheet costs a bisect and a few boundary moves
+    def __init__(self, max_count=None, max_age=None):
+        self.max_count = max_count
+        self.max_age = max_age
+        self.clear()
+
+    def clear(self):
+        self.window = deque()
+        self.minute = deque()
+        self.sorted = []
+        self.total = 0.0
+        self.top = 0
+        self.top_sum = 0.0
+        self.bottom = 0
+        self.bottom_sum = 0.0
+
+    def __len__(self):
+        return len(self.sorted)
+
+    def add(self, swing, time_us):
+        i = bisect.bisect_right(self.sorted, swing)
+        self.sorted.insert(i, swing)
+        self.total += swing
+        if i >= self.top:
+            self.top_sum += swing
+        else:
+            self.top += 1
+        if i < self.bottom:
+            self.bottom_sum += swing
+            self.bottom += 1
+        self.window.append((time_us, swing))
+        self.minute.append(time_us)
+        self.expire(time_us)
+
+    def remove(self, swing):
+        i = bisect.bisect_left(self.sorted, swing)
+        if i >= self.top:
+            self.top_sum -= swing
+        else:
+            self.top -= 1
+        if i < self.bottom:
+            self.bottom_sum -= swing
+            self.bottom -= 1
+        del self.sorted[i]
+        self.total -= swing
+
+    def expire(self, now_us):
+        # evict sheets outside the window, then move the 20% boundaries
+        while self.window and ((self.max_count is not None and len(self.window) > self.max_count)
+                               or (self.max_age is not None and self.window[0][0] < now_us-self.max_age)):
+            self.remove(self.window.popleft()[1])
+        while self.minute and self.minute[0] < now_us-60*10**6:
+            self.minute.popleft()
+        count_20 = round(len(self.sorted)*0.2)
+        while self.top > len(self.sorted)-count_20:
+            self.top -= 1
+            self.top_sum += self.sorted[self.top]
+        while self.top < len(self.sorted)-count_20:
+            self.top_sum -= self.sorted[self.top]
+            self.top += 1
+        while self.bottom < count_20:
+            self.bottom_sum += self.sorted[self.bottom]
+            self.bottom += 1
+        while self.bottom > count_20:
+            self.bottom -= 1
+            self.bottom_sum -= self.sorted[self.bottom]
+
+    def stats(self):
+        # count, avg_all, avg_first20, avg_last20 like get_swing_range, plus sheets of the last minute
+        count = len(self.sorted)
+        avg_all = self.total/count if count else 'NA'
+        if self.bottom > 0:
+            avg_first20 = self.top_sum/(count-self.top)
+            avg_last20 = self.bottom_sum/self.bottom
+        else:
+            avg_first20 = 'NA'
+            avg_last20 = 'NA'
+        return count, avg_all, avg_first20, avg_last20, len(self.minute)
@@ -0,0 +1,39 @@
+import numpy as np
+from sample_store import SAMPLE_RATE, format_lines
+
+
+def generate_swing(samples, cycle=60, cycle_jitter=0.3, gap=15, swing=40, noise=5, dropout=0.02,
+                   glass=(380, 460), background=850, seed=0):
+    # synthetic distance signal: sheets swinging inside the glass range, separated by background.
+    # cycle and gap are mean lengths in samples, swing the mean peak to peak swing of a sheet (mm),
+    # noise the sensor noise (mm) and dropout the share of samples read far below the distance range
+    rng = np.random.default_rng(seed)
+    count = samples//(cycle+gap)+2
+    lengths = np.empty(0, dtype='int64')
+    while lengths.sum() < samples:
+        cycles = np.maximum(rng.normal(cycle, cycle*cycle_jitter, count), 1).astype('int64')
+        gaps = rng.integers(gap//2+1, gap*3//2+2, count)
+        lengths = np.concatenate([lengths, np.column_stack([gaps, cycles]).ravel()])
+    count = lengths.size//2
+    # even segments are background, odd segments are sheets
+    segment = np.repeat(np.arange(lengths.size), lengths)[:samples]
+    position = np.arange(segment.size)-np.repeat(np.cumsum(lengths)-lengths, lengths)[:samples]
+    sheet = segment//2
+    base = rng.uniform(glass[0], glass[1], count)
+    amplitude = rng.uniform(0.5, 1.5, count)*swing/2
+    phase = 2*np.pi*position/lengths[segment]
+    distance = np.where(segment % 2 == 1, base[sheet]+amplitude[sheet]*np.sin(phase), background)
+    distance += rng.normal(0, noise, samples)
+    drop = rng.random(samples) < dropout
+    distance[drop] = rng.integers(0, 100, drop.sum())
+    return np.maximum(distance.round(), 0).astype('int32')
+
+
+def write_record(fileName, swing, start_us, note='', rate=SAMPLE_RATE, chunk_size=1 << 20):
+    # write `swing` as a text record file sampled at `rate` Hz from `start_us`
+    step = 10**6//rate
+    with open(fileName, 'w') as f:
+        print(f'Distance range: {note}', file=f)
+        for start in range(0, swing.size, chunk_size):
+            dist = swing[start:start+chunk_size]
+            f.write(format_lines(start_us+(start+np.arange(dist.size))*step, dist))
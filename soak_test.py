@@ -0,0 +1,106 @@
+"""Soak test of the acquisition: the main window reads a simulated sensor, dropped samples and latency are reported.
+
+python soak_test.py --rate 1000 --duration 60 --batch 100
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from time import monotonic
+import numpy as np
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+from PyQt5.QtCore import QSettings, QTimer
+from PyQt5.QtWidgets import QApplication
+from sensor_simulator import VirtualSensor
+
+
+class SoakProbe:
+    # receive time of every sample number, connected after the main window so it sees the samples last
+    def __init__(self):
+        self.numbers = []
+        self.times = []
+
+    def sample(self, channel, time, data):
+        self.numbers.append(data)
+        self.times.append(monotonic())
+
+    def block(self, channel, time_us, data):
+        self.numbers.extend(data.tolist())
+        self.times.extend([monotonic()]*data.size)
+
+    def report(self, sensor):
+        numbers = np.array(self.numbers, dtype='int64')
+        unique = np.unique(numbers)
+        latency = (np.array(self.times)-np.array(sensor.send_times)[numbers])*1000 if numbers.size else np.zeros(1)
+        return {'sent': sensor.sent, 'received': int(numbers.size), 'dropped': sensor.sent-int(unique.size),
+                'duplicated': int(numbers.size-unique.size), 'out_of_order': int(np.sum(np.diff(numbers) < 0)),
+                'malformed_sent': sensor.sent_malformed, 'overrun_bytes': sensor.overrun_bytes,
+                'latency_ms': {'median': float(np.median(latency)), 'p95': float(np.percentile(latency, 95)),
+                               'p99': float(np.percentile(latency, 99)), 'max': float(latency.max())}}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Soak test the acquisition against a simulated sensor.')
+    parser.add_argument('--rate', type=float, default=100, help='samples per second, default 100 (10x the sensor)')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of acquisition, default 30')
+    parser.add_argument('--batch', type=int, default=0, help='serial batch interval (ms), 0 emits every sample')
+    parser.add_argument('--burst', type=int, default=1, help='samples written at once by the sensor')
+    parser.add_argument('--malformed', type=float, default=0.0, help='share of extra malformed lines')
+    parser.add_argument('--silence', type=float, nargs=2, default=(0, 0), metavar=('EVERY', 'FOR'),
+                        help='sensor silent FOR seconds out of every EVERY seconds')
+    parser.add_argument('--json', help='write the report as JSON')
+    args = parser.parse_args(argv)
+    output = os.path.abspath(args.json) if args.json else None
+
+    # run in a scratch folder with scratch settings, the user's settings and logs stay untouched
+    folder = tempfile.mkdtemp(prefix='soak_')
+    QSettings.setPath(QSettings.NativeFormat, QSettings.UserScope, folder)
+    QSettings.setPath(QSettings.IniFormat, QSettings.UserScope, folder)
+    os.chdir(folder)
+    app = QApplication(sys.argv[:1])
+    import Call_main
+    window = Call_main.MyMainWindow()
+    window.settings.setValue('serial batch interval', args.batch)
+    window.textEdit_saveroute.setText(folder)
+    window.checkBox_record.setChecked(False)
+
+    sensor = VirtualSensor(args.rate, 'counter', args.burst, args.malformed, tuple(args.silence))
+    window.comboBox_port.addItem(sensor.port)
+    window.comboBox_port.setCurrentText(sensor.port)
+    window.lineEdit_extraport.setText('')
+    probe = SoakProbe()
+    window.push_start.setChecked(True)
+    window.monitor_state()
+    for thread in window.acquisition.threads.values():
+        thread.signal_ser_sample.connect(probe.sample)
+        thread.signal_ser_block.connect(probe.block)
+    sensor.start()
+
+    def finish():
+        sensor.stop()
+        # let the last lines through before stopping the port
+        QTimer.singleShot(max(500, 2*args.batch), stop)
+
+    def stop():
+        window.push_start.setChecked(False)
+        window.monitor_state()
+        QTimer.singleShot(2500, app.quit)
+
+    QTimer.singleShot(int(args.duration*1000), finish)
+    app.exec_()
+    sensor.close()
+
+    report = probe.report(sensor)
+    report.update({'rate': args.rate, 'duration': args.duration, 'batch_interval': args.batch, 'burst': args.burst,
+                   'folder': folder})
+    print(json.dumps(report, indent=2))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0 if report['dropped'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
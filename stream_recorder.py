@@ -0,0 +1,191 @@
+import logging
+import numpy as np
+import os
+import queue
+import threading
+import time
+import traceback
+from datetime import timedelta
+from binary_record import BINARY_SUFFIX, RECORD_DTYPE, PartialHeader, header_bytes, read_header, records, write_binary
+from sample_store import EPOCH, US_PER_DAY, format_lines, to_epoch_us
+
+logger = logging.getLogger(__name__)
+
+
+def save_record(fileName, note, chunks, binary=False):
+    # write detached (time_us, distance) chunks as a record file, meant to run off the GUI thread
+    try:
+        if binary:
+            write_binary(fileName, note, chunks)
+            return
+        with open(fileName, 'w') as f:
+            print(f'Distance range: {note}', file=f)
+            for t, d in chunks:
+                f.write(format_lines(t, d))
+    except OSError:
+        logger.error(f'{traceback.format_exc()}')
+
+
+def end_on_line(fileName, chunk_size=65536):
+    # cut a partial last line left by a crash, so that the next session does not write onto it
+    with open(fileName, 'rb+') as f:
+        end = f.seek(0, 2)
+        start = end
+        while start > 0:
+            start = max(start-chunk_size, 0)
+            f.seek(start)
+            tail = f.read(end-start)
+            if tail.endswith(b'\n'):
+                return
+            cut = tail.rfind(b'\n')
+            if cut >= 0 or start == 0:
+                f.truncate(start+cut+1)
+                logger.warning(f'Dropped {end-start-cut-1} bytes of a partial last line of {fileName}')
+                return
+
+
+def end_on_record(fileName):
+    # cut a partial last record left by a crash, the records after it would be shifted otherwise.
+    # A file that ends inside its header is emptied so that a new header is written, a file that
+    # is not a binary record file of a known version raises ValueError and is left as it is
+    with open(fileName, 'rb+') as f:
+        end = f.seek(0, 2)
+        f.seek(0)
+        try:
+            offset = read_header(f)[1]
+            size, part = offset+max(end-offset, 0)//RECORD_DTYPE.itemsize*RECORD_DTYPE.itemsize, 'last record'
+        except PartialHeader:
+            size, part = 0, 'header'
+        if size < end:
+            f.truncate(size)
+            logger.warning(f'Dropped {end-size} bytes of a partial {part} of {fileName}')
+        elif size > end:
+            # the padding of the header was cut
+            f.truncate(size)
+
+
+class RecordWriter(threading.Thread):
+    """Append samples to the daily record file from a background thread."""
+
+    def __init__(self, folder, note='', flush_interval=1.0, flush_size=600, fsync=False, suffix='',
+                 binary=False):
+        super(RecordWriter, self).__init__(daemon=True)
+        self.folder = folder
+        self.suffix = suffix
+        self.binary = binary
+        self.note = note
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.fsync = fsync
+        self.queue = queue.SimpleQueue()
+        self.file = None
+        self.file_day = None
+        self.pending_time = []
+        self.pending_dis = []
+
+    def put(self, time, dist):
+        self.queue.put((to_epoch_us(time), dist))
+
+    def put_block(self, time_us, dist):
+        self.queue.put((time_us, dist))
+
+    def flush(self, timeout=5):
+        # block until everything queued so far is on disk
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+
+    def file_name(self, day):
+        return os.path.join(self.folder, day.strftime('%y%m%d')+self.suffix+(BINARY_SUFFIX if self.binary else '.txt'))
+
+    def run(self):
+        deadline = time.monotonic()+self.flush_interval
+        while True:
+            try:
+                item = self.queue.get(timeout=max(deadline-time.monotonic(), 0))
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if isinstance(item, threading.Event):
+                self.write_pending()
+                item.set()
+                continue
+            if item:
+                self.add(*item)
+            if len(self.pending_time) >= self.flush_size or time.monotonic() >= deadline:
+                self.write_pending()
+                deadline = time.monotonic()+self.flush_interval
+        self.write_pending()
+        self.close()
+
+    def add(self, time_us, dist):
+        # queue samples for writing, rotating the file whenever a sample starts a new day
+        if not isinstance(time_us, np.ndarray):
+            if time_us//US_PER_DAY != self.file_day:
+                self.write_pending()
+                self.rotate(time_us//US_PER_DAY)
+            self.pending_time.append(time_us)
+            self.pending_dis.append(dist)
+            return
+        days = time_us//US_PER_DAY
+        bounds = np.concatenate([[0], np.flatnonzero(np.diff(days))+1, [days.size]])
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            if days[start] != self.file_day:
+                self.write_pending()
+                self.rotate(days[start])
+            self.pending_time.extend(time_us[start:stop].tolist())
+            self.pending_dis.extend(dist[start:stop].tolist())
+
+    def rotate(self, day):
+        self.close()
+        fileName = self.file_name(EPOCH+timedelta(days=int(day)))
+        self.file_day = day
+        try:
+            if os.path.exists(fileName) and self.binary:
+                end_on_record(fileName)
+            elif os.path.exists(fileName):
+                end_on_line(fileName)
+            new_file = not os.path.exists(fileName) or os.path.getsize(fileName) == 0
+            if self.binary:
+                self.file = open(fileName, 'ab')
+                if new_file:
+                    self.file.write(header_bytes(self.note))
+            else:
+                self.file = open(fileName, 'a')
+                if new_file:
+                    print(f'Distance range: {self.note}', file=self.file)
+        except OSError:
+            logger.error(f'{traceback.format_exc()}')
+            self.file = None
+        except ValueError as e:
+            # not a record file this version can append to, the samples of the day are not recorded
+            logger.error(f'Not recording to {fileName}: {e}')
+            self.file = None
+
+    def write_pending(self):
+        if not self.pending_time:
+            return
+        if self.file is not None:
+            try:
+                if self.binary:
+                    self.file.write(records(self.pending_time, self.pending_dis).tobytes())
+                else:
+                    self.file.write(format_lines(self.pending_time, self.pending_dis))
+                self.file.flush()
+                if self.fsync:
+                    os.fsync(self.file.fileno())
+            except OSError:
+                logger.error(f'{traceback.format_exc()}')
+        self.pending_time = []
+        self.pending_dis = []
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.file_day = None
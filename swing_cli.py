@@ -0,0 +1,127 @@
+"""Analyze history record files without the GUI, e.g. for nightly reports on a server.
+
+python swing_cli.py "D:/record/2303*.txt" --from 300 --to 700 --cycle-min 2 --json report.json --png report.png
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+from datetime import time
+import numpy as np
+import sheet_swing_calculation as ssc
+import history_batch
+from analysis_cache import AnalysisCache
+
+SUMMARY_FIELDS = ['file', 'count', 'avg_all', 'avg_first20', 'avg_last20', 'error']
+
+
+def expand_files(patterns):
+    # files matching the patterns in order, each file once
+    fileNames = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            raise FileNotFoundError(pattern)
+        for fileName in matches:
+            if not os.path.isfile(fileName):
+                raise FileNotFoundError(fileName)
+            if fileName not in fileNames:
+                fileNames.append(fileName)
+    return fileNames
+
+
+def plain(value):
+    # numpy scalars as python numbers for json/csv
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def write_json(fileName, summary):
+    with open(fileName, 'w') as f:
+        json.dump([{key: plain(value) for key, value in item.items()} for item in summary], f, indent=2)
+
+
+def write_csv(fileName, summary):
+    with open(fileName, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        for item in summary:
+            writer.writerow({key: plain(value) for key, value in item.items()})
+
+
+def write_png(fileName, swing_range, title):
+    # same histogram as the history tab, drawn with Agg so that no display is needed
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(8, 5), tight_layout=True)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    start = 2.5*(swing_range.min()//2.5)
+    counts, edges = np.histogram(swing_range, bins=np.arange(start, swing_range.max() + 2.5, 2.5))
+    ax.stairs(counts, edges, fill=True)
+    ax.set_title(title, fontsize=12)
+    ax.set_xlabel('Swing range (mm)')
+    ax.set_ylabel('Count')
+    ax.grid(True)
+    fig.savefig(fileName)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Count the sheets and their swing range in history record files.')
+    parser.add_argument('files', nargs='+', help='record files or glob patterns')
+    parser.add_argument('--from', dest='dis_from', type=int, required=True, help='distance from (mm)')
+    parser.add_argument('--to', dest='dis_to', type=int, required=True, help='distance to (mm)')
+    parser.add_argument('--cycle-min', type=float, default=0, help='shortest sheet cycle (s), default 0')
+    parser.add_argument('--cycle-max', type=float, default=3600, help='longest sheet cycle (s), default 1 hour')
+    parser.add_argument('--start', type=time.fromisoformat, help='analyze from this time of day (HH:MM) in every file')
+    parser.add_argument('--end', type=time.fromisoformat, help='analyze until this time of day (HH:MM), may be past midnight')
+    parser.add_argument('--by-time', action='store_true',
+                        help='segment on the recorded times (lost samples, any sample rate) instead of counting every sample as 0.1 s')
+    parser.add_argument('--cache', action='store_true',
+                        help='keep the sheets found in every file next to it, a rerun only filters them again')
+    parser.add_argument('--workers', type=int, default=None, help='processes for several files, default one per CPU')
+    parser.add_argument('--json', help='write the summary of every file and the total as JSON')
+    parser.add_argument('--csv', help='write the summary of every file and the total as CSV')
+    parser.add_argument('--png', help='write the swing range histogram of all files as PNG')
+    args = parser.parse_args(argv)
+
+    if (args.start is None) != (args.end is None):
+        parser.error('--start and --end go together')
+    try:
+        fileNames = expand_files(args.files)
+    except FileNotFoundError as e:
+        parser.error(f'Can not find the file: {e}')
+    try:
+        sheet_count, sheets, summary = history_batch.analyze_files(fileNames, args.dis_from, args.dis_to,
+                                                                   args.cycle_min, args.cycle_max,
+                                                                   workers=args.workers,
+                                                                   window=None if args.start is None else (args.start, args.end),
+                                                                   timestamps=args.by_time,
+                                                                   cache=AnalysisCache(disk=True) if args.cache else None)
+    except ssc.SwingException as e:
+        for item in e.args[0]:
+            print(f"{item['file']}: {item['error']}", file=sys.stderr)
+        return 1
+    swing_range, avg_all, avg_first20, avg_last20, ind_first20, ind_last20 = ssc.get_swing_range(sheets, sheet_count)
+    summary.append({'file': 'total', 'count': sheet_count, 'avg_all': avg_all,
+                    'avg_first20': avg_first20, 'avg_last20': avg_last20})
+
+    for item in summary:
+        if 'error' in item:
+            print(f"{item['file']}: {item['error'].strip()}", file=sys.stderr)
+        else:
+            first20, last20 = (f'{item[key]:.2f}' if item[key] != 'NA' else 'NA' for key in ('avg_first20', 'avg_last20'))
+            print(f"{item['file']}: {item['count']} sheets, average {item['avg_all']:.2f}, "
+                  f"first 20% {first20}, last 20% {last20}")
+    if args.json:
+        write_json(args.json, summary)
+    if args.csv:
+        write_csv(args.csv, summary)
+    if args.png:
+        write_png(args.png, swing_range, f'Swing range distribution of {len(fileNames)} file(s)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+import sheet_swing_calculation as ssc
+from analysis_cache import AnalysisCache
+from record_archive import ARCHIVE_SUFFIX
+from signal_generator import generate_swing
+
+RATE = 10
+CYCLE_LIMITS = [(2, 3600), (4, 8), (5, 6.5), (0, 3600)]
+
+
+def signal(seed):
+    # 10 Hz samples with a 2 minute and a 0.5 s hole
+    swing = generate_swing(12000, seed=seed)
+    times = 1680000000*10**6+np.arange(swing.size, dtype='int64')*10**5
+    keep = np.ones(swing.size, dtype=bool)
+    keep[3000:4200] = False
+    keep[8000:8005] = False
+    return swing[keep], times[keep]
+
+
+def assert_same_sheets(result, expected):
+    (count, sheets), (expected_count, matrix) = result, expected
+    assert count == expected_count
+    assert np.array_equal(ssc.overlap_sheets(sheets.values, sheets.offsets), matrix.astype('float32'),
+                          equal_nan=True)
+
+
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('timestamps', [False, True])
+@pytest.mark.parametrize('dis_from, dis_to', [(350, 500), (400, 440)])
+def test_two_stages_match_get_each_sheet(tmp_path, seed, timestamps, dis_from, dis_to):
+    swing, times = signal(seed)
+    times = times if timestamps else None
+    identity = (str(tmp_path/'230330.txt'), swing.size, seed)
+    params = (dis_from, dis_to, None, timestamps)
+    cache = AnalysisCache()
+    runs = ssc.find_sheets(swing, dis_from, dis_to, times)
+    for i, cycle_limits in enumerate(CYCLE_LIMITS):
+        expected = ssc.get_each_sheet(swing, dis_from, dis_to, cycle_limits[0]*RATE, cycle_limits[1]*RATE,
+                                      times=times)
+        if i == 0:
+            assert cache.sheets(identity, params, cycle_limits) is None
+            result = cache.add_runs(identity, params, cycle_limits, runs)
+        else:
+            # only the cycle limits changed, the cached runs are filtered again
+            result = cache.sheets(identity, params, cycle_limits)
+        assert_same_sheets(result, expected)
+        assert cache.sheets(identity, params, cycle_limits)[1] is result[1]
+
+
+def test_disk_tier(tmp_path):
+    swing, times = signal(0)
+    params = (350, 500, None, True)
+    runs = ssc.find_sheets(swing, 350, 500, times)
+    identity = (str(tmp_path/'230330.txt'), swing.size, 1)
+    AnalysisCache(disk=True).add_runs(identity, params, (2, 3600), runs)
+    assert len(list((tmp_path/'.cache').glob('*.npz'))) == 1
+    # another session reads the runs back, a changed file is a miss
+    cache = AnalysisCache(disk=True)
+    assert_same_sheets(cache.sheets(identity, params, (4, 8)),
+                       ssc.get_each_sheet(swing, 350, 500, 40, 80, times=times))
+    assert cache.sheets((identity[0], swing.size+1, 2), params, (4, 8)) is None
+
+
+def test_no_sidecar_for_archives(tmp_path):
+    swing, times = signal(1)
+    runs = ssc.find_sheets(swing, 350, 500, times)
+    identity = (str(tmp_path/('230330.txt'+ARCHIVE_SUFFIX)), swing.size, 1)
+    AnalysisCache(disk=True).add_runs(identity, (350, 500, None, True), (2, 3600), runs)
+    assert not (tmp_path/'.cache').exists()
+
+
+def test_memory_bound():
+    swing, _ = signal(2)
+    runs = ssc.find_sheets(swing, 350, 500)
+    cache = AnalysisCache(max_bytes=runs.nbytes*3)
+    for seed in range(5):
+        cache.add_runs(('230330.txt', swing.size, seed), (350, 500, None, False), (2, 3600), runs)
+    assert cache.size <= cache.max_bytes
+    assert cache.sheets(('230330.txt', swing.size, 0), (350, 500, None, False), (2, 3600)) is None
+    assert cache.sheets(('230330.txt', swing.size, 4), (350, 500, None, False), (2, 3600)) is not None
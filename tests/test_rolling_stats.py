@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+import sheet_swing_calculation as ssc
+
+
+def batch_stats(swings):
+    # get_swing_range on the window, one sheet per column with the swing as its range
+    swings = np.asarray(swings, dtype='float64')
+    matrix = np.vstack([np.zeros(swings.size), swings])
+    return ssc.get_swing_range(matrix, swings.size)[1:4]
+
+
+def assert_stats(stats, window):
+    count, avg_all, avg_first20, avg_last20 = stats.stats()[:4]
+    assert count == len(window)
+    if not window:
+        return
+    expected = batch_stats([swing for _, swing in window])
+    assert avg_all == pytest.approx(expected[0])
+    for value, reference in zip((avg_first20, avg_last20), expected[1:]):
+        if reference == 'NA':
+            assert value == 'NA'
+        else:
+            assert value == pytest.approx(reference)
+
+
+@pytest.mark.parametrize('max_count, max_age', [(None, None), (1, None), (7, None), (100, None),
+                                                (None, 30*10**6), (50, 20*10**6)])
+def test_rolling_stats_match_batch(max_count, max_age):
+    rng = np.random.default_rng(3)
+    stats = ssc.RollingSwingStats(max_count, max_age)
+    window = []
+    time_us = 0
+    # few distinct values, so that equal swings sit on the 20% boundaries
+    for swing in rng.integers(20, 30, 600).astype(float):
+        time_us += int(rng.integers(1, 3*10**6))
+        stats.add(swing, time_us)
+        window.append((time_us, swing))
+        if max_count is not None:
+            window = window[-max_count:]
+        if max_age is not None:
+            window = [item for item in window if item[0] >= time_us-max_age]
+        assert_stats(stats, window)
+
+
+def test_rolling_stats_expire_without_sheets():
+    stats = ssc.RollingSwingStats(max_age=10*10**6)
+    window = [(i*10**6, float(i % 4)) for i in range(20)]
+    for time_us, swing in window:
+        stats.add(swing, time_us)
+    for now_us in range(19*10**6, 32*10**6, 10**6):
+        stats.expire(now_us)
+        assert_stats(stats, [item for item in window if item[0] >= now_us-10*10**6])
+    assert len(stats) == 0
+
+
+def test_rolling_stats_minute():
+    stats = ssc.RollingSwingStats()
+    for second in range(0, 120, 5):
+        stats.add(10.0, second*10**6)
+    assert stats.stats()[4] == 13
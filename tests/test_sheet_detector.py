@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+import sheet_swing_calculation as ssc
+from signal_generator import generate_swing
+
+RATE = 10
+
+
+def detect(swing, dis_from, dis_to, cycle_min, cycle_max):
+    detector = ssc.SheetDetector(dis_from, dis_to, cycle_min, cycle_max, RATE)
+    return detector.update_block(swing)
+
+
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('limits', [(350, 500, 2, 3600), (400, 440, 2, 3600), (350, 500, 4, 8)])
+def test_detector_matches_batch(seed, limits):
+    dis_from, dis_to, cycle_min, cycle_max = limits
+    swing = generate_swing(20000, dropout=0.05, seed=seed)
+    count, matrix = ssc.get_each_sheet(swing, dis_from, dis_to, cycle_min*RATE, cycle_max*RATE)
+    swing_range, avg_all, avg_first20, avg_last20 = ssc.get_swing_range(matrix, count)[:4]
+    sheets = detect(swing, dis_from, dis_to, cycle_min, cycle_max)
+    assert len(sheets) == count
+    assert [sheet['count'] for sheet in sheets] == list(range(1, count+1))
+    assert np.array_equal([sheet['swing'] for sheet in sheets], swing_range)
+    assert np.mean([sheet['swing'] for sheet in sheets]) == pytest.approx(avg_all)
+
+
+def test_detector_block_split():
+    # the state carries over between blocks
+    swing = generate_swing(5000, seed=7)
+    whole = detect(swing, 350, 500, 2, 3600)
+    detector = ssc.SheetDetector(350, 500, 2, 3600, RATE)
+    parts = []
+    for block in np.array_split(swing, [1, 2, 77, 1000, 2500, 4999]):
+        parts += detector.update_block(block)
+    assert parts == whole
+
+
+def test_detector_drops_first_and_last_sheet():
+    sheet = [850, 400, 410, 430, 420, 400, 850]
+    sheets = detect(np.array(sheet*3), 350, 500, 0, 10)
+    assert [s['swing'] for s in sheets] == [20.0]
+    assert ssc.get_each_sheet(np.array(sheet*3), 350, 500, 0, 100)[0] == 1
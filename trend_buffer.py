@@ -0,0 +1,108 @@
+import numpy as np
+
+
+class RingBuffer:
+    """Fixed size ring of (x, y) samples with an ordered view that needs no copy."""
+
+    def __init__(self, capacity, y_shape=()):
+        # every sample is written at i and i+capacity, so the samples in order
+        # are always one contiguous slice of the doubled arrays
+        self.capacity = capacity
+        self.y_shape = y_shape
+        self.x = np.empty(2*capacity)
+        self.y = np.empty((2*capacity,)+y_shape)
+        self.next = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def clear(self):
+        self.next = 0
+        self.size = 0
+
+    def append(self, x, y):
+        self.x[self.next] = self.x[self.next+self.capacity] = x
+        self.y[self.next] = self.y[self.next+self.capacity] = y
+        self.next = (self.next+1) % self.capacity
+        self.size = min(self.size+1, self.capacity)
+
+    def extend(self, x, y):
+        x = x[-self.capacity:]
+        y = y[-self.capacity:]
+        n = len(x)
+        # at most two runs: up to the end of the ring, then from its start
+        first = min(n, self.capacity-self.next)
+        for start, stop, offset in ((self.next, self.next+first, 0), (0, n-first, first)):
+            if stop > start:
+                self.x[start:stop] = self.x[start+self.capacity:stop+self.capacity] = x[offset:offset+stop-start]
+                self.y[start:stop] = self.y[start+self.capacity:stop+self.capacity] = y[offset:offset+stop-start]
+        self.next = (self.next+n) % self.capacity
+        self.size = min(self.size+n, self.capacity)
+
+    def view(self):
+        start = (self.next-self.size) % self.capacity
+        return self.x[start:start+self.size], self.y[start:start+self.size]
+
+    def last(self):
+        return self.x[(self.next-1) % self.capacity] if self.size else None
+
+    def set_last(self, x, y):
+        # overwrite the newest sample in place
+        i = (self.next-1) % self.capacity
+        self.x[i] = self.x[i+self.capacity] = x
+        self.y[i] = self.y[i+self.capacity] = y
+
+    def resize(self, capacity):
+        x, y = self.view()
+        x = x.copy()
+        y = y.copy()
+        self.__init__(capacity, self.y_shape)
+        self.extend(x, y)
+
+
+class MinMaxPyramid:
+    """Min and max of the samples per time bucket, at several bucket widths, updated as samples arrive."""
+
+    def __init__(self, levels):
+        # levels: (bucket width in x units, number of buckets kept), finest first
+        self.widths = [width for width, capacity in levels]
+        self.levels = [RingBuffer(capacity, (2,)) for width, capacity in levels]
+        self.open = [None]*len(levels)
+
+    def clear(self):
+        for level in self.levels:
+            level.clear()
+        self.open = [None]*len(self.levels)
+
+    def push(self, x, y):
+        # one sample: widen the open bucket in place or start a new one
+        for k, (width, level) in enumerate(zip(self.widths, self.levels)):
+            bucket = x//width
+            if bucket != self.open[k]:
+                level.append(bucket*width, (y, y))
+                self.open[k] = bucket
+                continue
+            i = (level.next-1) % level.capacity
+            if y < level.y[i, 0]:
+                level.y[i, 0] = level.y[i+level.capacity, 0] = y
+            elif y > level.y[i, 1]:
+                level.y[i, 1] = level.y[i+level.capacity, 1] = y
+
+    def extend(self, x, y):
+        if len(x) == 0:
+            return
+        y = np.asarray(y)
+        for k, (width, level) in enumerate(zip(self.widths, self.levels)):
+            bucket = np.floor(x/width).astype('int64')
+            starts = np.concatenate([[0], np.flatnonzero(np.diff(bucket))+1])
+            y_range = np.column_stack([np.minimum.reduceat(y, starts), np.maximum.reduceat(y, starts)])
+            if bucket[0] == self.open[k]:
+                # the first samples close the bucket still open at the end of the ring
+                last = level.y[(level.next-1) % level.capacity]
+                y_range[0] = min(y_range[0, 0], last[0]), max(y_range[0, 1], last[1])
+                level.set_last(bucket[0]*width, y_range[0])
+                starts = starts[1:]
+                y_range = y_range[1:]
+            level.extend(bucket[starts]*width, y_range)
+            self.open[k] = bucket[-1]